@@ -0,0 +1,152 @@
+"""Azure OpenAI Batch API mode for offline extraction jobs.
+
+Pages that already have a Doc Intel layout are rendered into Batch API JSONL request files
+(split to stay under the service's size and request-count limits), uploaded and submitted.
+Once the batches finish, their outputs are matched back to file/page by custom_id and turned
+into the same records (including per-field logprob confidences) that batch_runner writes
+for real-time runs.
+
+All calls go through the client passed in, so a client pointed at a local fake endpoint
+can be used to exercise the flow without Azure.
+"""
+import json
+import os
+import time
+
+from streaming_fields import StreamingFieldParser
+
+BATCH_ENDPOINT = "/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# Azure OpenAI global batch limits per input file
+BATCH_MAX_FILE_BYTES = 200 * 1024 * 1024
+BATCH_MAX_REQUESTS = 100000
+BATCH_POLL_SECONDS = 60
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def render_request(custom_id, model, messages, temperature, max_tokens, logprobs=True):
+    """Render one chat-completion request as a Batch API JSONL entry."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "response_format": {"type": "json_object"},
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "logprobs": logprobs,
+        },
+    }
+
+
+def write_request_files(requests, output_dir, prefix="batch_input", max_file_bytes=BATCH_MAX_FILE_BYTES,
+                        max_requests=BATCH_MAX_REQUESTS):
+    """Write requests to as many JSONL files as needed to respect the per-file limits; return their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    batch_file, file_bytes, file_requests = None, 0, 0
+    for request in requests:
+        line = (json.dumps(request) + "\n").encode("utf-8")
+        if len(line) > max_file_bytes:
+            raise ValueError(f"Request {request['custom_id']} is larger than the {max_file_bytes} byte file limit")
+        if batch_file is None or file_bytes + len(line) > max_file_bytes or file_requests >= max_requests:
+            if batch_file is not None:
+                batch_file.close()
+            paths.append(os.path.join(output_dir, f"{prefix}_{len(paths):03d}.jsonl"))
+            batch_file, file_bytes, file_requests = open(paths[-1], "wb"), 0, 0
+        batch_file.write(line)
+        file_bytes += len(line)
+        file_requests += 1
+    if batch_file is not None:
+        batch_file.close()
+    return paths
+
+
+def submit_request_files(client, paths):
+    """Upload each request file and create a batch job for it; return the batch ids."""
+    batch_ids = []
+    for path in paths:
+        with open(path, "rb") as request_file:
+            uploaded = client.files.create(file=request_file, purpose="batch")
+        batch = client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                      completion_window=BATCH_COMPLETION_WINDOW)
+        print(f"Submitted {path} as batch {batch.id}")
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def wait_for_batches(client, batch_ids, poll_seconds=BATCH_POLL_SECONDS, sleep=time.sleep):
+    """Poll until every batch reaches a terminal status; return the final batch objects."""
+    pending = list(batch_ids)
+    finished = {}
+    while pending:
+        for batch_id in list(pending):
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in BATCH_TERMINAL_STATUSES:
+                print(f"Batch {batch_id} {batch.status}")
+                finished[batch_id] = batch
+                pending.remove(batch_id)
+        if pending:
+            sleep(poll_seconds)
+    return [finished[batch_id] for batch_id in batch_ids]
+
+
+def download_outputs(client, batch):
+    """Return the output and error lines of a finished batch, parsed from JSONL."""
+    lines = []
+    for file_id in (batch.output_file_id, getattr(batch, "error_file_id", None)):
+        if not file_id:
+            continue
+        content = client.files.content(file_id).text
+        lines.extend(json.loads(line) for line in content.splitlines() if line.strip())
+    return lines
+
+
+def parse_completion(body):
+    """Turn a chat-completion response body into (content, fields with confidences)."""
+    choice = body["choices"][0]
+    content = choice["message"]["content"] or ""
+    parser = StreamingFieldParser()
+    token_logprobs = (choice.get("logprobs") or {}).get("content")
+    if token_logprobs:
+        for token_logprob in token_logprobs:
+            parser.feed(token_logprob["token"], token_logprob["logprob"])
+    else:
+        parser.feed(content, None)
+    return content, parser
+
+
+def reconcile(output_lines, items):
+    """Match batch outputs to their pages by custom_id.
+
+    items maps custom_id to the page record (item_id, source, page_number, task, layout).
+    Returns (records, failures): records carry a "result" in the same shape as a real-time
+    extraction of that task; failures map custom_id to the error.
+    """
+    records, failures, answered = [], {}, set()
+    for line in output_lines:
+        custom_id = line.get("custom_id")
+        if custom_id not in items:
+            continue
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code", 200) != 200:
+            failures[custom_id] = line.get("error") or response.get("body")
+            continue
+        try:
+            content, parser = parse_completion(response["body"])
+            record = dict(items[custom_id])
+            if record["task"] == "check":
+                record["result"] = parser.file_fields()
+            else:
+                record["result"] = {"content": content, "fields": parser.fields}
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+            failures[custom_id] = f"Unreadable batch output: {e}"
+            continue
+        records.append(record)
+        answered.add(custom_id)
+    for custom_id in items:
+        if custom_id not in answered and custom_id not in failures:
+            failures[custom_id] = "No output returned for request"
+    return records, failures
@@ -0,0 +1,360 @@
+"""Headless, resumable batch OCR + extraction over a directory of images and PDFs.
+
+Usage:
+    python batch_runner.py data/new_data --task check --output results/batch_results.jsonl \
+        --summary-csv results/results_summary.csv
+
+Every page is analyzed with Doc Intel and extracted with GPT through the concurrent page
+pipeline. Each finished page is appended to a single JSONL output file, and its id is
+appended to a manifest next to it, so re-running the same command after a crash skips the
+pages that already completed and retries the ones that failed.
+
+With --batch-api the GPT step goes through the Azure OpenAI Batch API instead: requests are
+submitted as batch jobs, and the run (or a later run with the same arguments, e.g. after
+--no-wait) polls them and appends the reconciled results in the same format.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import time
+from collections import Counter
+
+from PIL import Image
+
+import batch_api
+import metrics
+from idp_agent import (PageImage, iter_pdf_pages, get_pdf_page_count, rasterize_page, cached_analyze_document,
+                       cached_extract_check_fields, cached_stream_fields_from_image_form, check_extraction_messages,
+                       form_extraction_messages, client, AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_TEMP,
+                       AZURE_OPENAI_MAX_TOKENS, RASTER_FORMAT)
+from pipeline import PagePipeline, DOC_INTEL_CONCURRENCY, GPT_CONCURRENCY
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+# Image types GPT vision accepts as-is; other images are re-encoded like rasterized PDF pages
+VISION_MIME_TYPES = ("image/jpeg", "image/png")
+PDF_EXTENSIONS = (".pdf",)
+
+
+class StageError(Exception):
+    """A page failure tagged with the pipeline stage it happened in.
+
+    The wrapped error's status_code and response are kept, so call_with_retries still
+    retries throttled and transient failures.
+    """
+
+    def __init__(self, stage, error):
+        super().__init__(f"{stage}: {error}")
+        self.stage = stage
+        self.error = error
+        self.status_code = getattr(error, "status_code", None)
+        self.response = getattr(error, "response", None)
+
+
+def find_input_files(input_dir):
+    """Return the image and PDF files under input_dir, sorted for a stable processing order."""
+    input_files = []
+    for root, _, files in os.walk(input_dir):
+        for file_name in files:
+            if file_name.lower().endswith(IMAGE_EXTENSIONS + PDF_EXTENSIONS):
+                input_files.append(os.path.join(root, file_name))
+    return sorted(input_files)
+
+
+def item_id(input_dir, path, page_number):
+    """Stable id of one page of an input file, e.g. "checks/a.pdf#3"."""
+    return f"{os.path.relpath(path, input_dir).replace(os.sep, '/')}#{page_number}"
+
+
+def load_manifest(manifest_path):
+    """Return the ids of items recorded as completed in the manifest."""
+    completed = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as manifest_file:
+            for line in manifest_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partially written last line
+                    continue
+                completed.add(entry["item_id"])
+    return completed
+
+
+def iter_pages(input_dir, input_files, completed, failures):
+    """Yield (item_id, source path, PageImage) for every page not yet completed."""
+    for path in input_files:
+        try:
+            if path.lower().endswith(PDF_EXTENSIONS):
+                # Only rasterize the pages a previous run didn't finish
+                pending = [page_number for page_number in range(1, get_pdf_page_count(path) + 1)
+                           if item_id(input_dir, path, page_number) not in completed]
+                for page_image in iter_pdf_pages(path, pending, document=os.path.relpath(path, input_dir)):
+                    yield item_id(input_dir, path, page_image.page_number), path, page_image
+            else:
+                page_id = item_id(input_dir, path, 1)
+                if page_id not in completed:
+                    yield page_id, path, load_image_page(path)
+        except Exception as e:
+            print(f"Failed to rasterize {path}: {e}")
+            failures["rasterize"] += 1
+
+
+def load_image_page(path):
+    """Read an image file as a PageImage, re-encoding types GPT vision doesn't accept (BMP, TIFF)."""
+    mime_type = mimetypes.guess_type(path)[0]
+    if mime_type in VISION_MIME_TYPES:
+        with open(path, "rb") as image_file:
+            return PageImage(1, image_file.read(), mime_type)
+    # Only the first frame of a multi-page TIFF is used
+    with Image.open(path) as image:
+        return PageImage(1, rasterize_page(image),
+                         Image.MIME.get(RASTER_FORMAT.upper(), f"image/{RASTER_FORMAT.lower()}"))
+
+
+def analyze_page(page):
+    _, _, page_image = page
+    try:
+        doc_intel_result = cached_analyze_document(page_image)
+    except Exception as e:
+        raise StageError("analyze", e)
+    return doc_intel_result
+
+
+def make_extract_page(task):
+    extract = cached_extract_check_fields if task == "check" else cached_stream_fields_from_image_form
+
+    def extract_page(page, doc_intel_result):
+        _, _, page_image = page
+        try:
+            return extract(page_image, doc_intel_result)
+        except Exception as e:
+            raise StageError("extract", e)
+    return extract_page
+
+
+def write_summary_csv(output_path, csv_path):
+    """Flatten the JSONL output into one row per page with a column (and confidence) per field."""
+    import pandas as pd
+
+    rows = []
+    with open(output_path, "r") as output_file:
+        for line in output_file:
+            record = json.loads(line)
+            row = {"item_id": record["item_id"], "file_name": os.path.basename(record["source"]),
+                   "page_number": record["page_number"]}
+            for field in record["result"].get("fields", []):
+                row[field["field_name"]] = field["field_value"]
+                row[f"{field['field_name']}_confidence"] = field["field_confidence"]
+            rows.append(row)
+    # A resumed run may have re-appended pages that completed just before a crash; keep the last
+    pd.DataFrame(rows).drop_duplicates("item_id", keep="last").to_csv(csv_path, index=False)
+    print(f"CSV file generated at: {csv_path}")
+
+
+def append_records(output_file, manifest_file, records):
+    """Append finished page records to the output, then mark them completed in the manifest."""
+    for record in records:
+        # Output first, then manifest: a crash in between re-processes the page rather than losing it
+        output_file.write(json.dumps(record) + "\n")
+        output_file.flush()
+        manifest_file.write(json.dumps({"item_id": record["item_id"]}) + "\n")
+        manifest_file.flush()
+
+
+def page_labels(page):
+    page_id, _, page_image = page
+    return {"document": page_id.rsplit("#", 1)[0], "page": page_image.page_number}
+
+
+def run_batch(input_dir, output_path, task="check", doc_intel_concurrency=DOC_INTEL_CONCURRENCY,
+              gpt_concurrency=GPT_CONCURRENCY):
+    """Process every pending page under input_dir and return a summary of the run."""
+    manifest_path = output_path + ".manifest.jsonl"
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    completed = load_manifest(manifest_path)
+    input_files = find_input_files(input_dir)
+    failures = Counter()
+    processed = 0
+    skipped = len(completed)
+
+    pipeline = PagePipeline(analyze_page, make_extract_page(task), doc_intel_concurrency, gpt_concurrency,
+                            page_labels=page_labels)
+    start = time.perf_counter()
+    with open(output_path, "a") as output_file, open(manifest_path, "a") as manifest_file:
+        for _, page, layout, result, error in pipeline.run(iter_pages(input_dir, input_files, completed, failures)):
+            page_id, source, page_image = page
+            if error is not None:
+                failures[getattr(error, "stage", "unknown")] += 1
+                print(f"Failed {page_id}: {error}")
+                continue
+            append_records(output_file, manifest_file, [{
+                "item_id": page_id, "source": source, "page_number": page_image.page_number,
+                "task": task, "layout": layout, "result": result,
+            }])
+            processed += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "files": len(input_files),
+        "pages_processed": processed,
+        "pages_skipped": skipped,
+        "failures": dict(failures),
+        "elapsed_seconds": round(elapsed, 2),
+        "pages_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+def submit_batch_jobs(input_dir, output_path, task="check", doc_intel_concurrency=DOC_INTEL_CONCURRENCY,
+                      deployment=AZURE_OPENAI_DEPLOYMENT, batch_client=client):
+    """Run Doc Intel for pending pages, then submit their GPT requests as Batch API jobs.
+
+    The custom_id -> page mapping and the batch ids are saved to a state file next to the
+    output so the jobs can be collected by a later run. Returns (state, failures).
+    """
+    completed = load_manifest(output_path + ".manifest.jsonl")
+    input_files = find_input_files(input_dir)
+    failures = Counter()
+    build_messages = check_extraction_messages if task == "check" else form_extraction_messages
+    items = {}
+
+    def render_page(page, doc_intel_result):
+        # Render the request on the worker so base64 encoding overlaps with Doc Intel calls
+        page_id, _, page_image = page
+        return batch_api.render_request(page_id, deployment, build_messages(page_image, doc_intel_result),
+                                        AZURE_OPENAI_TEMP, AZURE_OPENAI_MAX_TOKENS)
+
+    # No GPT calls happen here, so the "GPT" slots only bound local request rendering
+    pipeline = PagePipeline(analyze_page, render_page, doc_intel_concurrency, doc_intel_concurrency,
+                            page_labels=page_labels)
+
+    def rendered_requests():
+        # Requests (each with a base64 page image) go straight to the request files as they are rendered
+        for index, page, layout, request, error in pipeline.run(iter_pages(input_dir, input_files, completed,
+                                                                           failures)):
+            page_id, source, page_image = page
+            if error is not None:
+                failures[getattr(error, "stage", "unknown")] += 1
+                print(f"Failed {page_id}: {error}")
+                continue
+            custom_id = f"request-{len(items)}"
+            request["custom_id"] = custom_id
+            items[custom_id] = {"item_id": page_id, "source": source, "page_number": page_image.page_number,
+                                "task": task, "layout": layout}
+            yield request
+
+    request_dir = output_path + ".batch"
+    paths = batch_api.write_request_files(rendered_requests(), request_dir)
+    state = {"items": items, "batch_ids": batch_api.submit_request_files(batch_client, paths)}
+    with open(os.path.join(request_dir, "state.json"), "w") as state_file:
+        json.dump(state, state_file)
+    return state, failures
+
+
+def collect_batch_jobs(output_path, batch_client=client, poll_seconds=batch_api.BATCH_POLL_SECONDS):
+    """Wait for submitted Batch API jobs and append their reconciled results to the output.
+
+    Returns a summary in the same shape as run_batch, or None if no jobs are pending.
+    """
+    state_path = os.path.join(output_path + ".batch", "state.json")
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r") as state_file:
+        state = json.load(state_file)
+
+    start = time.perf_counter()
+    batches = batch_api.wait_for_batches(batch_client, state["batch_ids"], poll_seconds)
+    output_lines = []
+    for batch in batches:
+        output_lines.extend(batch_api.download_outputs(batch_client, batch))
+    records, batch_failures = batch_api.reconcile(output_lines, state["items"])
+    for custom_id, error in batch_failures.items():
+        print(f"Failed {state['items'][custom_id]['item_id']}: {error}")
+
+    with open(output_path, "a") as output_file, open(output_path + ".manifest.jsonl", "a") as manifest_file:
+        append_records(output_file, manifest_file, records)
+    # The jobs are done; failed pages are picked up again by the next submission
+    os.replace(state_path, state_path + ".collected")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "files": len({item["source"] for item in state["items"].values()}),
+        "pages_processed": len(records),
+        "pages_skipped": 0,
+        "failures": {"batch": len(batch_failures)} if batch_failures else {},
+        "elapsed_seconds": round(elapsed, 2),
+        "pages_per_second": round(len(records) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+def run_mode(args, batch_client=client):
+    """Run the requested mode and return its summary, or None when jobs were only submitted."""
+    if args.batch_api:
+        # Jobs from a previous submission are collected before anything new is submitted
+        pending_state = os.path.join(args.output + ".batch", "state.json")
+        if not os.path.exists(pending_state):
+            state, failures = submit_batch_jobs(args.input_dir, args.output, args.task, args.doc_intel_concurrency,
+                                                args.batch_deployment, batch_client)
+            print(f"Submitted {len(state['items'])} requests in {len(state['batch_ids'])} batch jobs")
+            for stage, count in sorted(failures.items()):
+                print(f"  {stage} failures: {count}")
+            if args.no_wait:
+                return None
+        return collect_batch_jobs(args.output, batch_client, args.batch_poll_seconds)
+    return run_batch(args.input_dir, args.output, args.task, args.doc_intel_concurrency, args.gpt_concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run OCR + GPT extraction over a directory of images and PDFs.")
+    parser.add_argument("input_dir", help="Directory to scan (recursively) for images and PDFs")
+    parser.add_argument("--output", default=os.path.join("results", "batch_results.jsonl"),
+                        help="JSONL file that results are appended to; its manifest is stored alongside")
+    parser.add_argument("--task", choices=["check", "form"], default="check",
+                        help="Extraction prompt: check fields (CheckDate, Payee, Amount, MICR) or generic form fields")
+    parser.add_argument("--doc-intel-concurrency", type=int, default=DOC_INTEL_CONCURRENCY)
+    parser.add_argument("--gpt-concurrency", type=int, default=GPT_CONCURRENCY)
+    parser.add_argument("--summary-csv", help="Also write a one-row-per-page CSV summary of the output")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Submit the GPT step as Azure OpenAI Batch API jobs instead of real-time calls")
+    parser.add_argument("--batch-deployment", default=AZURE_OPENAI_DEPLOYMENT,
+                        help="Global batch deployment to use with --batch-api")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="With --batch-api, submit and exit; re-run the same command to collect the results")
+    parser.add_argument("--batch-poll-seconds", type=float, default=batch_api.BATCH_POLL_SECONDS,
+                        help="With --batch-api, seconds between batch status checks")
+    parser.add_argument("--metrics-prom", help="Write per-stage latency, token and retry metrics in Prometheus text format")
+    parser.add_argument("--metrics-jsonl", help="Append every recorded metric span and counter to this JSON lines file")
+    args = parser.parse_args()
+
+    run_metrics = metrics.RunMetrics()
+    with metrics.use_metrics(run_metrics):
+        summary = run_mode(args)
+    if args.metrics_prom:
+        run_metrics.write_prometheus(args.metrics_prom)
+    if args.metrics_jsonl:
+        run_metrics.write_jsonl(args.metrics_jsonl)
+    if summary is None:
+        return
+    if args.summary_csv:
+        write_summary_csv(args.output, args.summary_csv)
+
+    print(f"Processed {summary['pages_processed']} pages from {summary['files']} files "
+          f"({summary['pages_skipped']} already completed) in {summary['elapsed_seconds']}s "
+          f"- {summary['pages_per_second']} pages/sec")
+    for stage, count in sorted(summary["failures"].items()):
+        print(f"  {stage} failures: {count}")
+    metrics_summary = run_metrics.summary()
+    for stage, stats in metrics_summary["stages"].items():
+        print(f"  {stage}: {stats['count']} calls, p50 {stats['p50_seconds']}s, p95 {stats['p95_seconds']}s")
+    counters = metrics_summary["counters"]
+    print(f"  tokens: {int(counters.get('prompt_tokens', 0))} prompt / {int(counters.get('completion_tokens', 0))} "
+          f"completion, {int(counters.get('retries', 0))} retries, "
+          f"estimated cost ${metrics_summary['estimated_cost_usd']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
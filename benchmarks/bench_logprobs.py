@@ -0,0 +1,117 @@
+"""Compare the legacy and vectorized LogprobsHandler on synthetic logprob streams.
+
+Usage: python benchmarks/bench_logprobs.py [--sizes 1000 10000 100000 500000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logprobs_handler_custom import LogprobsHandler  # noqa: E402
+
+FIELD_NAMES = ["CheckDate", "Payee", "Amount", "MICR", "Memo", "Bank", "Routing", "Account"]
+
+
+class LegacyLogprobsHandler(LogprobsHandler):
+    """The original DataFrame/iterrows implementation, kept here as the reference output."""
+
+    def calculate_words_probas(self, logprobs_formatted):
+        probas_df = pd.DataFrame({'token': [i['token'] for i in logprobs_formatted],
+                                  'logprob': [i['logprob'] for i in logprobs_formatted]})
+        key_value_pairs = []
+        current_pair = []
+        for idx, row in probas_df.iterrows():
+            token = str(row['token'])
+            if token.strip() != '' and not token.strip() in ['{', '}']:
+                current_pair.append(idx)
+            if token.endswith(',\n') or token.endswith(']\n') or token.strip().endswith(',') or token.strip().endswith(
+                    '}') or token.endswith('"}') or token.endswith("'}") or token.endswith(',"') or token.endswith(
+                ",'"):
+                if len(current_pair) > 0:
+                    key_value_pairs.append(current_pair)
+                current_pair = []
+        pair_probs = []
+        for pair in key_value_pairs:
+            pair_logprob = probas_df.loc[pair, 'logprob'].sum()
+            pair_prob = self.logprob_to_prob(pair_logprob)
+            pair_probs.append((''.join(probas_df.loc[pair, 'token']), pair_prob))
+        return pair_probs
+
+    def process_logprobs(self, logprobs_formatted, nested_keys_dct=None):
+        pair_probs = self.calculate_words_probas(logprobs_formatted)
+        pair_df = pd.DataFrame(pair_probs, columns=['key_value_pair', 'agg_tokens_proba'])
+        pair_df['field_name'] = pair_df['key_value_pair'].apply(self.extract_key_name)
+        pair_df = pair_df[pair_df['field_name'].notna()]
+        if nested_keys_dct is not None:
+            for nested_key_name, nested_key_values in nested_keys_dct.items():
+                nested_key_str = '|'.join(nested_key_values)
+                nested_rows = pair_df[pair_df['field_name'].str.contains(nested_key_str, case=False)]
+                if len(nested_rows) > 0:
+                    new_row = pd.DataFrame({
+                        'key_value_pair': [' '.join(nested_rows['key_value_pair'])],
+                        'agg_tokens_proba': [nested_rows['agg_tokens_proba'].prod()],
+                        'field_name': [nested_key_name]
+                    })
+                    pair_df = pd.concat([pair_df, new_row], axis=0, ignore_index=True)
+        pair_df['agg_tokens_proba'] = pair_df['agg_tokens_proba'].round(4)
+        return dict(pair_df.set_index('field_name')['agg_tokens_proba'].to_dict())
+
+
+def synthetic_logprobs(n_tokens, seed=0):
+    """Build a chat-completion style token stream of a JSON field list, n_tokens long."""
+    rng = random.Random(seed)
+    tokens = ['{"', 'file_name', '":', ' "', 'check', '.png', '",', '\n', ' "', 'fields', '":', ' [\n']
+    while len(tokens) < n_tokens:
+        name = rng.choice(FIELD_NAMES)
+        value_tokens = [str(rng.randint(0, 9999)) for _ in range(rng.randint(1, 4))]
+        tokens += ['  {"', 'field', '_name', '":', ' "', name, '",', ' "', 'field', '_value', '":', ' "']
+        tokens += value_tokens + ['"},\n']
+    tokens = tokens[:n_tokens] + ['  ]\n', '}']
+    # Mostly confident tokens with an occasional uncertain one
+    return [{'token': token, 'logprob': -rng.expovariate(50) if rng.random() > 0.02 else -rng.uniform(0.5, 3),
+             'log_topprobs': []} for token in tokens]
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 500000])
+    parser.add_argument("--legacy-max-tokens", type=int, default=100000,
+                        help="Skip the (slow) legacy implementation above this many tokens")
+    args = parser.parse_args()
+
+    legacy, vectorized = LegacyLogprobsHandler(), LogprobsHandler()
+    nested_keys = {"Check": ["CheckDate", "Amount"], "Bank details": ["Bank", "Routing", "Account"]}
+    print(f"{'tokens':>8} {'legacy s':>10} {'new s':>10} {'speedup':>8}  output")
+    for size in args.sizes:
+        logprobs = synthetic_logprobs(size)
+        new_pairs, new_time = _timed(vectorized.calculate_words_probas, logprobs)
+        new_fields, fields_time = _timed(vectorized.process_logprobs, logprobs, nested_keys)
+        new_time += fields_time
+        if size > args.legacy_max_tokens:
+            print(f"{size:>8} {'skipped':>10} {new_time:>10.3f} {'':>8}  {len(new_pairs)} pairs")
+            continue
+
+        old_pairs, old_time = _timed(legacy.calculate_words_probas, logprobs)
+        old_fields, fields_time = _timed(legacy.process_logprobs, logprobs, nested_keys)
+        old_time += fields_time
+        same = ([pair for pair, _ in old_pairs] == [pair for pair, _ in new_pairs]
+                and np.allclose([p for _, p in old_pairs], [p for _, p in new_pairs], rtol=1e-9, atol=0)
+                and old_fields.keys() == new_fields.keys()
+                and all(abs(old_fields[k] - new_fields[k]) <= 1e-4 for k in old_fields))
+        print(f"{size:>8} {old_time:>10.3f} {new_time:>10.3f} {old_time / new_time:>7.1f}x  "
+              f"{len(new_pairs)} pairs, {'identical' if same else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
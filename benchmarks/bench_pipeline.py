@@ -0,0 +1,225 @@
+"""End-to-end pipeline benchmark against local fake Doc Intel and Azure OpenAI services.
+
+Generates synthetic multi-page PDFs, points the app's clients at benchmarks/fake_services.py,
+and runs each PDF through idp_agent.process_document as a background job, then
+idp_agent.finish_run for the discrepancy check - the same code path as the Streamlit app.
+The PDFs are generated and the fake services run in separate processes, so their memory and
+CPU don't count against the pipeline. Reports pages/sec, p50/p95 latency per stage, token and
+retry counts, and peak RSS (with the RSS reached before the run, after imports).
+
+Usage:
+    python benchmarks/bench_pipeline.py --documents 3 --pages 10 --gpt-latency 1.5 --throttle-rate 0.05 \
+        --json-output results/bench_pipeline.json
+
+The run happens in a temporary working directory with a generated config.py, so no Azure
+credentials are needed and the on-disk result cache starts empty every time. With
+--min-pages-per-sec the script exits non-zero below that throughput, for CI-style checks.
+--triage turns on page triage with its default settings.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+import fake_services  # noqa: E402
+
+PAGE_SIZE = (1700, 2200)
+FAKE_DEPLOYMENT = "fake-gpt"
+
+
+def make_synthetic_pdf(path, pages, seed):
+    """Write a PDF of letter-size pages with form-like text lines and checkboxes."""
+    rng = random.Random(seed)
+    images = []
+    for page_number in range(1, pages + 1):
+        image = Image.new("L", PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(image)
+        for line_index in range(40):
+            y = 100 + line_index * 48
+            draw.text((100, y), f"Page {page_number} field {line_index}: {rng.choice(fake_services.PAYEES)} "
+                                f"{rng.choice(fake_services.AMOUNTS)} {rng.choice(fake_services.DATES)}", fill=0)
+            if line_index % 4 == 0:
+                draw.rectangle((1400, y, 1430, y + 30), outline=0, fill=0 if rng.random() < 0.5 else 255)
+        images.append(image)
+    images[0].save(path, "PDF", resolution=200, save_all=True, append_images=images[1:])
+    for image in images:
+        image.close()
+
+
+def make_synthetic_pdfs(paths, pages, seed):
+    """Write the synthetic PDFs from worker processes, so their page images never count toward this process's RSS."""
+    with multiprocessing.Pool(min(len(paths), os.cpu_count() or 1)) as pool:
+        pool.starmap(make_synthetic_pdf, [(path, pages, seed + index) for index, path in enumerate(paths)])
+
+
+def serve_fake_services(config, port_queue):
+    server = fake_services.FakeServiceServer(("127.0.0.1", 0), config)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def write_config(config_dir, base_url):
+    """Write a config.py pointing every Azure client at the fake services."""
+    with open(os.path.join(config_dir, "config.py"), "w") as config_file:
+        config_file.write(
+            f'AZURE_OPENAI_KEY = "fake-key"\n'
+            f'AZURE_OPENAI_ENDPOINT = "{base_url}"\n'
+            f'AZURE_OPENAI_DEPLOYMENT = "{FAKE_DEPLOYMENT}"\n'
+            f'AZURE_DOC_INTEL_ENDPOINT = "{base_url}"\n'
+            f'AZURE_DOC_INTEL_KEY = "fake-key"\n'
+            f'AZURE_STORAGE_CONNECTION_STRING = "UseDevelopmentStorage=true"\n'
+        )
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def page_latencies(run_metrics):
+    """Seconds from each page's first recorded stage (rasterization) to its last one."""
+    started, finished = {}, {}
+    for event in map(json.loads, run_metrics.to_jsonl().splitlines()):
+        if "document" not in event or "page" not in event:
+            continue
+        page = (event["document"], event["page"])
+        start = event["time"] - (event["value"] if event["kind"] == "span" else 0)
+        started[page] = min(started.get(page, start), start)
+        finished[page] = max(finished.get(page, event["time"]), event["time"])
+    return [finished[page] - started[page] for page in started]
+
+
+def run_flow(pdf_paths, doc_intel_concurrency, gpt_concurrency, whole_pdf, triage_settings=None):
+    """Run each PDF through idp_agent.process_document as a job, then finish_run.
+
+    Returns (run summary, page latencies, pages, failed pages).
+    """
+    # Imported late so the generated config.py and working directory are used
+    import idp_agent
+    import metrics
+    from jobs import JobManager
+
+    raster_settings = {"dpi": idp_agent.RASTER_DPI, "grayscale": idp_agent.RASTER_GRAYSCALE,
+                       "image_format": idp_agent.RASTER_FORMAT, "quality": idp_agent.RASTER_QUALITY,
+                       "max_pixels": idp_agent.RASTER_MAX_PIXELS}
+    service_slots = idp_agent.get_service_slots(doc_intel_concurrency, gpt_concurrency)
+    job_manager = JobManager()
+    jobs = [job_manager.submit(path, os.path.basename(path), idp_agent.process_document, path, None, whole_pdf,
+                               raster_settings, doc_intel_concurrency, gpt_concurrency, triage_settings,
+                               service_slots)
+            for path in pdf_paths]
+    while not all(job.done for job in jobs):
+        time.sleep(0.05)
+    run = idp_agent.finish_run(jobs)
+
+    pages, failures = 0, 0
+    for job in jobs:
+        if job.status == "failed":
+            print(f"Job {job.name} failed: {job.error}")
+        for page_number, (_, result, error) in sorted(job.state.get("completed", {}).items()):
+            pages += 1
+            skipped = job.state["triage"].get(page_number, {}).get("action") == "skip"
+            if error is not None or (not skipped and not (result and result["content"])):
+                failures += 1
+                print(f"Failed page {page_number} of {job.name}: {error}")
+    run_metrics = metrics.merged([job.state["metrics"] for job in jobs if "metrics" in job.state])
+    return run, page_latencies(run_metrics), pages, failures
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full OCR + GPT pipeline against local fake services.")
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic PDF")
+    parser.add_argument("--doc-intel-concurrency", type=int, default=4)
+    parser.add_argument("--gpt-concurrency", type=int, default=4)
+    parser.add_argument("--per-page-analysis", action="store_true",
+                        help="Analyze each page image separately instead of one Doc Intel call per PDF")
+    parser.add_argument("--triage", action="store_true",
+                        help="Skip blank/duplicate pages and send text-heavy pages without the image")
+    parser.add_argument("--json-output", help="Write the report as JSON to this path")
+    parser.add_argument("--min-pages-per-sec", type=float,
+                        help="Exit with status 1 if throughput falls below this value")
+    fake_services.add_config_arguments(parser)
+    args = parser.parse_args()
+    json_output = os.path.abspath(args.json_output) if args.json_output else None
+
+    work_dir = tempfile.mkdtemp(prefix="idp_bench_")
+    pdf_paths = [os.path.join(work_dir, f"synthetic_{index}.pdf") for index in range(args.documents)]
+    make_synthetic_pdfs(pdf_paths, args.pages, args.seed)
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_fake_services,
+                                     args=(fake_services.config_from_args(args), port_queue), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+    write_config(work_dir, base_url)
+    sys.path[:0] = [work_dir, REPO_DIR]
+    os.chdir(work_dir)
+
+    # The app's modules are imported up front so the run's RSS growth can be told apart from import costs
+    import idp_agent  # noqa: F401
+    rss_before_run = peak_rss_bytes()
+    try:
+        start = time.perf_counter()
+        run, latencies, pages, failures = run_flow(pdf_paths, args.doc_intel_concurrency, args.gpt_concurrency,
+                                                   not args.per_page_analysis, {} if args.triage else None)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+
+    summary = run["metrics"]
+    report = {
+        "documents": args.documents,
+        "pages": pages,
+        "failed_pages": failures,
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 3) if elapsed > 0 else 0.0,
+        "page_p50_seconds": round(percentile(latencies, 0.5), 4),
+        "page_p95_seconds": round(percentile(latencies, 0.95), 4),
+        "rss_before_run_mb": round(rss_before_run / 1024 / 1024, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 1024 / 1024, 1),
+        "discrepancy_groups": len(run["discrepancies"]),
+        "stages": summary["stages"],
+        "counters": summary["counters"],
+        "settings": vars(args),
+    }
+
+    print(f"{pages} pages ({failures} failed) in {report['elapsed_seconds']}s - {report['pages_per_second']} pages/sec, "
+          f"page p50 {report['page_p50_seconds']}s / p95 {report['page_p95_seconds']}s, "
+          f"peak RSS {report['peak_rss_mb']} MB ({report['rss_before_run_mb']} MB before the run)")
+    print(f"{'stage':<22}{'calls':>7}{'p50 s':>10}{'p95 s':>10}{'total s':>10}")
+    for stage, stats in summary["stages"].items():
+        print(f"{stage:<22}{stats['count']:>7}{stats['p50_seconds']:>10}{stats['p95_seconds']:>10}"
+              f"{stats['total_seconds']:>10}")
+    for name, value in summary["counters"].items():
+        print(f"{name}: {value}")
+
+    if json_output:
+        os.makedirs(os.path.dirname(json_output), exist_ok=True)
+        with open(json_output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    if args.min_pages_per_sec is not None and report["pages_per_second"] < args.min_pages_per_sec:
+        print(f"Throughput below --min-pages-per-sec {args.min_pages_per_sec}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""Local stand-ins for the Azure Doc Intel and Azure OpenAI endpoints used by the app.
+
+The server speaks just enough of both REST APIs for the real SDK clients to work against it:
+
+- POST .../documentModels/{model}:analyze returns 202 with an Operation-Location; polling it
+  reports "running" until the configured latency has passed, then "succeeded" with a
+  synthetic layout (lines, selection marks, a table and styles per page, plus key-value
+  pairs when the keyValuePairs feature is requested).
+- POST /openai/deployments/{deployment}/chat/completions returns a JSON completion of check
+  or form fields, streamed as server-sent events (with per-token logprobs and a final usage
+  chunk) when requested.
+- POST /openai/files, POST /openai/batches, GET /openai/batches/{id} and
+  GET /openai/files/{id}/content emulate the Batch API: a batch stays "in_progress" for the
+  configured latency, then completes with an output file of chat completions and an error
+  file for the requests picked by batch_error_rate, or (at batch_expire_rate) expires with
+  every request in the error file.
+
+Any POST can be answered with a 429 at a configurable rate, with Retry-After headers, to
+exercise the retry paths.
+
+Usage: python benchmarks/fake_services.py --port 8765 --doc-intel-latency 1.0 --gpt-latency 2.0
+"""
+import argparse
+import email.parser
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DOC_INTEL_API_VERSION = "2024-07-31-preview"
+ANALYZE_PATH_RE = re.compile(r"/documentModels/(?P<model>[^/:]+):analyze$")
+RESULT_PATH_RE = re.compile(r"/documentModels/(?P<model>[^/:]+)/analyzeResults/(?P<result_id>[^/]+)$")
+CHAT_PATH_RE = re.compile(r"/openai/deployments/(?P<deployment>[^/]+)/chat/completions$")
+FILES_PATH_RE = re.compile(r"/openai/files$")
+FILE_CONTENT_PATH_RE = re.compile(r"/openai/files/(?P<file_id>[^/]+)/content$")
+BATCHES_PATH_RE = re.compile(r"/openai/batches$")
+BATCH_PATH_RE = re.compile(r"/openai/batches/(?P<batch_id>[^/]+)$")
+PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?!s)")
+TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+PAYEES = ["ACME Corporation", "Contoso Ltd", "Fabrikam Inc", "Northwind Traders", "Tailspin Toys"]
+AMOUNTS = ["125.00", "1,250.00", "980.45", "3,400.10", "75.99"]
+DATES = ["01/15/2024", "02/01/2024", "03/22/2024", "04/30/2024"]
+CHECKBOX_LABELS = ["Married", "Employed", "US Citizen", "Has dependents"]
+
+
+class FakeServiceConfig:
+    """Latency, throttling and payload settings of the fake services."""
+
+    def __init__(self, doc_intel_latency=1.0, doc_intel_page_latency=0.1, poll_interval=0.05, gpt_latency=1.0,
+                 token_latency=0.002, throttle_rate=0.0, throttle_retry_after=0.1, logprobs=True,
+                 lines_per_page=40, seed=0, batch_latency=1.0, batch_error_rate=0.0, batch_expire_rate=0.0):
+        self.doc_intel_latency = doc_intel_latency
+        self.doc_intel_page_latency = doc_intel_page_latency
+        self.poll_interval = poll_interval
+        self.gpt_latency = gpt_latency
+        self.token_latency = token_latency
+        self.throttle_rate = throttle_rate
+        self.throttle_retry_after = throttle_retry_after
+        self.logprobs = logprobs
+        self.lines_per_page = lines_per_page
+        self.seed = seed
+        self.batch_latency = batch_latency
+        self.batch_error_rate = batch_error_rate
+        self.batch_expire_rate = batch_expire_rate
+
+
+def _page_count(body, pages):
+    if pages:
+        page_numbers = set()
+        for part in pages.split(","):
+            start, _, end = part.strip().partition("-")
+            page_numbers.update(range(int(start), int(end or start) + 1))
+        return sorted(page_numbers)
+    count = len(PDF_PAGE_RE.findall(body)) if body[:5] == b"%PDF-" else 1
+    return list(range(1, max(count, 1) + 1))
+
+
+def synthetic_layout(model, page_numbers, lines_per_page, rng, key_value_pairs=False):
+    """Build an analyzeResult with lines, selection marks, a table and a handwriting style per page.
+
+    With key_value_pairs the "Key: value" lines are also returned as key-value pairs.
+    """
+    content, pages, tables, styles, pairs = [], [], [], [], []
+    offset = 0
+
+    def add_text(text):
+        nonlocal offset
+        span = {"offset": offset, "length": len(text)}
+        content.append(text + "\n")
+        offset += len(text) + 1
+        return span
+
+    for page_number in page_numbers:
+        page_start = offset
+        lines = []
+        for line_index in range(lines_per_page):
+            kind = line_index % 5
+            if kind == 0:
+                text = f"Pay to the order of: {rng.choice(PAYEES)}"
+            elif kind == 1:
+                text = f"Amount: ${rng.choice(AMOUNTS)}"
+            elif kind == 2:
+                text = f"Date: {rng.choice(DATES)}"
+            elif kind == 3:
+                text = f"{rng.choice(CHECKBOX_LABELS)}"
+            else:
+                text = f"Section {line_index} instructions - please complete all fields in ink."
+            y = line_index * 0.25
+            polygon = [0.5, y, 8, y, 8, y + 0.2, 0.5, y + 0.2]
+            span = add_text(text)
+            lines.append({"content": text, "polygon": polygon, "spans": [span]})
+            if key_value_pairs and kind < 3:
+                key, value = text.split(": ", 1)
+                region = [{"pageNumber": page_number, "polygon": polygon}]
+                pairs.append({"confidence": 0.9,
+                              "key": {"content": key, "boundingRegions": region,
+                                      "spans": [{"offset": span["offset"], "length": len(key)}]},
+                              "value": {"content": value, "boundingRegions": region,
+                                        "spans": [{"offset": span["offset"] + len(key) + 2, "length": len(value)}]}})
+        # One checkbox to the left of each checkbox label line
+        marks = [{"state": rng.choice(["selected", "unselected"]), "confidence": round(rng.uniform(0.6, 1.0), 3),
+                  "polygon": [0.2, y, 0.4, y, 0.4, y + 0.2, 0.2, y + 0.2], "span": add_text(":selected:")}
+                 for y in (line_index * 0.25 for line_index in range(3, lines_per_page, 5))]
+        region = [{"pageNumber": page_number, "polygon": [0, 5, 8, 5, 8, 7, 0, 7]}]
+        cells = []
+        for row_index, row in enumerate([["Item", "Qty", "Price"], ["Widget", "2", "10.00"], ["Gadget", "1", "25.50"]]):
+            for column_index, cell_text in enumerate(row):
+                cells.append({"kind": "columnHeader" if row_index == 0 else "content", "rowIndex": row_index,
+                              "columnIndex": column_index, "content": cell_text, "boundingRegions": region,
+                              "spans": [add_text(cell_text)]})
+        tables.append({"rowCount": 3, "columnCount": 3, "cells": cells, "boundingRegions": region, "spans": []})
+        page_span = {"offset": page_start, "length": offset - page_start}
+        styles.append({"isHandwritten": True, "confidence": 0.9, "spans": [lines[0]["spans"][0]]})
+        pages.append({"pageNumber": page_number, "angle": 0, "width": 8.5, "height": 11, "unit": "inch",
+                      "words": [], "lines": lines, "selectionMarks": marks, "spans": [page_span]})
+
+    result = {"apiVersion": DOC_INTEL_API_VERSION, "modelId": model, "stringIndexType": "textElements",
+              "content": "".join(content), "pages": pages, "tables": tables, "styles": styles}
+    if key_value_pairs:
+        result["keyValuePairs"] = pairs
+    return result
+
+
+def synthetic_completion(messages, rng):
+    """Return the JSON completion text for a discrepancy classification, check or form extraction prompt."""
+    system_prompt = next((message["content"] for message in messages if message.get("role") == "system"), "")
+    if "consistency" in str(system_prompt).lower():
+        # Discrepancy classification: label every group it was given
+        user_text = str(messages[-1]["content"])
+        groups = json.loads(user_text[user_text.index("{"):])
+        document = {label: rng.choice(["consistent", "discrepancy"]) for label in groups}
+    elif "image of a check" in str(system_prompt).lower():
+        document = {"file_name": f"page_{rng.randrange(10000)}.jpg", "fields": [
+            {"field_name": "CheckDate", "field_value": rng.choice(DATES)},
+            {"field_name": "Payee", "field_value": rng.choice(PAYEES)},
+            {"field_name": "Amount", "field_value": rng.choice(AMOUNTS).replace(",", "")},
+            {"field_name": "MICR", "field_value": str(rng.randrange(1000, 10000))},
+        ]}
+    else:
+        document = {"fields": [
+            {"field_name": "Name", "field_value": rng.choice(PAYEES)},
+            {"field_name": "Date of Birth", "field_value": rng.choice(DATES)},
+            {"field_name": "Total Amount", "field_value": rng.choice(AMOUNTS)},
+            *[{"field_name": label, "field_value": rng.choice(["checked", "unchecked"])} for label in CHECKBOX_LABELS],
+        ]}
+    return json.dumps(document, indent=2)
+
+
+def completion_response(request, deployment, rng, logprobs=True):
+    """Build a chat completion for request; returns (text, tokens, token logprobs, usage, response body)."""
+    text = synthetic_completion(request.get("messages", []), rng)
+    tokens = TOKEN_RE.findall(text)
+    token_logprobs = [round(-abs(rng.gauss(0, 0.05)), 5) for _ in tokens]
+    usage = {"prompt_tokens": _prompt_tokens(request.get("messages", [])), "completion_tokens": len(tokens)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    choice = {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+    if logprobs and request.get("logprobs"):
+        choice["logprobs"] = {"content": [{"token": token, "logprob": logprob, "bytes": None, "top_logprobs": []}
+                                          for token, logprob in zip(tokens, token_logprobs)]}
+    body = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+            "model": deployment, "choices": [choice], "usage": usage}
+    return text, tokens, token_logprobs, usage, body
+
+
+def batch_results(input_lines, rng, error_rate=0.0, expired=False):
+    """Answer Batch API request lines; returns (output lines, error lines) as JSONL-ready dicts."""
+    outputs, errors = [], []
+    for line in input_lines:
+        request_id = uuid.uuid4().hex
+        if expired:
+            errors.append({"id": f"batch_req_{request_id}", "custom_id": line["custom_id"], "response": None,
+                           "error": {"code": "batch_expired", "message": "This request could not be executed "
+                                                                          "before the completion window expired."}})
+        elif rng.random() < error_rate:
+            errors.append({"id": f"batch_req_{request_id}", "custom_id": line["custom_id"],
+                           "response": {"status_code": 500, "request_id": request_id,
+                                        "body": {"error": {"code": "server_error", "message": "Injected failure"}}},
+                           "error": None})
+        else:
+            body = completion_response(line["body"], line["body"].get("model", ""), rng)[-1]
+            outputs.append({"id": f"batch_req_{request_id}", "custom_id": line["custom_id"],
+                            "response": {"status_code": 200, "request_id": request_id, "body": body},
+                            "error": None})
+    return outputs, errors
+
+
+def _prompt_tokens(messages):
+    # Rough estimate: ~4 characters per text token plus a flat cost per image
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            tokens += len(part.get("text", "")) // 4 if part.get("type") == "text" else 765
+    return tokens
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _throttled(self):
+        config = self.server.config
+        if config.throttle_rate and self.server.rng.random() < config.throttle_rate:
+            retry_after = config.throttle_retry_after
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                            {"Retry-After": str(max(1, int(round(retry_after)))),
+                             "retry-after-ms": str(int(retry_after * 1000))})
+            return True
+        return False
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.count("requests")
+        if self._throttled():
+            self.server.count("throttled")
+            return
+        analyze = ANALYZE_PATH_RE.search(url.path)
+        if analyze:
+            self._start_analysis(analyze.group("model"), url, body)
+            return
+        chat = CHAT_PATH_RE.search(url.path)
+        if chat:
+            self._chat_completion(chat.group("deployment"), json.loads(body))
+            return
+        if FILES_PATH_RE.search(url.path):
+            self._upload_file(body)
+            return
+        if BATCHES_PATH_RE.search(url.path):
+            self._create_batch(json.loads(body))
+            return
+        self._send_json(404, {"error": {"code": "NotFound", "message": url.path}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.count("requests")
+        file_content = FILE_CONTENT_PATH_RE.search(url.path)
+        if file_content:
+            self._file_content(file_content.group("file_id"))
+            return
+        batch = BATCH_PATH_RE.search(url.path)
+        if batch:
+            self._retrieve_batch(batch.group("batch_id"))
+            return
+        result = RESULT_PATH_RE.search(url.path)
+        operation = self.server.operations.get(result.group("result_id")) if result else None
+        if operation is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": url.path}})
+            return
+        config = self.server.config
+        if time.monotonic() < operation["ready_at"]:
+            self._send_json(200, {"status": "running", "createdDateTime": operation["created"],
+                                  "lastUpdatedDateTime": operation["created"]},
+                            {"retry-after-ms": str(int(config.poll_interval * 1000))})
+            return
+        self._send_json(200, {"status": "succeeded", "createdDateTime": operation["created"],
+                              "lastUpdatedDateTime": operation["created"], "analyzeResult": operation["result"]})
+
+    def _start_analysis(self, model, url, body):
+        config = self.server.config
+        query = parse_qs(url.query)
+        if "json" in self.headers.get("Content-Type", ""):
+            # url_source requests carry no document bytes; treat them as a single page
+            body = b""
+        page_numbers = _page_count(body, (query.get("pages") or [None])[0])
+        result_id = uuid.uuid4().hex
+        with self.server.lock:
+            rng = random.Random(f"{config.seed}:{len(self.server.operations)}")
+            self.server.operations[result_id] = None
+        self.server.operations[result_id] = {
+            "ready_at": time.monotonic() + config.doc_intel_latency + config.doc_intel_page_latency * len(page_numbers),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "result": synthetic_layout(model, page_numbers, config.lines_per_page, rng,
+                                       "keyValuePairs" in ",".join(query.get("features", []))),
+        }
+        base_path = url.path[:url.path.index("/documentModels/")]
+        operation_location = (f"http://{self.headers.get('Host')}{base_path}/documentModels/{model}/analyzeResults/"
+                              f"{result_id}?api-version={DOC_INTEL_API_VERSION}")
+        self.send_response(202)
+        self.send_header("Operation-Location", operation_location)
+        self.send_header("retry-after-ms", str(int(config.poll_interval * 1000)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _upload_file(self, body):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+        content = fields["file"].get_payload(decode=True)
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self.server.lock:
+            self.server.files[file_id] = content
+        self._send_json(200, {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                              "filename": fields["file"].get_filename() or "upload.jsonl",
+                              "purpose": fields["purpose"].get_payload(decode=True).decode("utf-8"),
+                              "status": "processed"})
+
+    def _create_batch(self, request):
+        config = self.server.config
+        if request.get("input_file_id") not in self.server.files:
+            self._send_json(404, {"error": {"code": "NotFound", "message": "input file not found"}})
+            return
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with self.server.lock:
+            expired = self.server.rng.random() < config.batch_expire_rate
+            self.server.batches[batch_id] = {
+                "batch": {"id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                          "input_file_id": request["input_file_id"],
+                          "completion_window": request["completion_window"], "status": "in_progress",
+                          "created_at": int(time.time()), "output_file_id": None, "error_file_id": None},
+                "ready_at": time.monotonic() + config.batch_latency,
+                "expired": expired,
+            }
+        self._send_json(200, self.server.batches[batch_id]["batch"])
+
+    def _retrieve_batch(self, batch_id):
+        entry = self.server.batches.get(batch_id)
+        if entry is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": batch_id}})
+            return
+        with self.server.lock:
+            batch = entry["batch"]
+            if batch["status"] == "in_progress" and time.monotonic() >= entry["ready_at"]:
+                self._finish_batch(entry)
+        self._send_json(200, batch)
+
+    def _finish_batch(self, entry):
+        config, batch = self.server.config, entry["batch"]
+        input_lines = [json.loads(line) for line in self.server.files[batch["input_file_id"]].splitlines()
+                       if line.strip()]
+        # Seeded by the request file so the same submission always gets the same errors
+        rng = random.Random(str(config.seed).encode("utf-8") + self.server.files[batch["input_file_id"]])
+        outputs, errors = batch_results(input_lines, rng, config.batch_error_rate, entry["expired"])
+        for kind, lines in (("output_file_id", outputs), ("error_file_id", errors)):
+            if lines:
+                file_id = f"file-{uuid.uuid4().hex}"
+                self.server.files[file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                batch[kind] = file_id
+        batch["status"] = "expired" if entry["expired"] else "completed"
+        batch["request_counts"] = {"total": len(input_lines), "completed": len(outputs), "failed": len(errors)}
+
+    def _file_content(self, file_id):
+        content = self.server.files.get(file_id)
+        if content is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": file_id}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _chat_completion(self, deployment, request):
+        config = self.server.config
+        with self.server.lock:
+            rng = random.Random(f"{config.seed}:{self.server.counters.get('chat', 0)}")
+            self.server.counters["chat"] = self.server.counters.get("chat", 0) + 1
+        text, tokens, logprobs, usage, body = completion_response(request, deployment, rng, config.logprobs)
+        want_logprobs = config.logprobs and request.get("logprobs")
+        completion_id = body["id"]
+        created = body["created"]
+
+        time.sleep(config.gpt_latency)
+        if not request.get("stream"):
+            time.sleep(config.token_latency * len(tokens))
+            self._send_json(200, body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(choices, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                     "choices": choices, **extra}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for token, logprob in zip(tokens, logprobs):
+            time.sleep(config.token_latency)
+            choice = {"index": 0, "delta": {"content": token}, "finish_reason": None}
+            if want_logprobs:
+                choice["logprobs"] = {"content": [{"token": token, "logprob": logprob, "bytes": None, "top_logprobs": []}]}
+            send_chunk([choice])
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_chunk([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeServiceHandler)
+        self.config = config
+        self.operations = {}
+        self.files = {}
+        self.batches = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_services(config=None, host="127.0.0.1", port=0):
+    """Start the fake services on a background thread and return the running server."""
+    server = FakeServiceServer((host, port), config or FakeServiceConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    """Add the FakeServiceConfig settings to an argparse parser."""
+    defaults = FakeServiceConfig()
+    parser.add_argument("--doc-intel-latency", type=float, default=defaults.doc_intel_latency,
+                        help="Seconds before an analyze operation succeeds")
+    parser.add_argument("--doc-intel-page-latency", type=float, default=defaults.doc_intel_page_latency,
+                        help="Additional analyze seconds per page")
+    parser.add_argument("--poll-interval", type=float, default=defaults.poll_interval,
+                        help="Poll interval the fake asks Doc Intel clients to use")
+    parser.add_argument("--gpt-latency", type=float, default=defaults.gpt_latency,
+                        help="Seconds before the first completion token")
+    parser.add_argument("--token-latency", type=float, default=defaults.token_latency,
+                        help="Seconds per completion token")
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate,
+                        help="Fraction of POST requests answered with HTTP 429")
+    parser.add_argument("--throttle-retry-after", type=float, default=defaults.throttle_retry_after,
+                        help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--no-logprobs", action="store_true", help="Omit logprobs from completions")
+    parser.add_argument("--lines-per-page", type=int, default=defaults.lines_per_page)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--batch-latency", type=float, default=defaults.batch_latency,
+                        help="Seconds a Batch API job stays in progress")
+    parser.add_argument("--batch-error-rate", type=float, default=defaults.batch_error_rate,
+                        help="Fraction of batch requests answered in the error file")
+    parser.add_argument("--batch-expire-rate", type=float, default=defaults.batch_expire_rate,
+                        help="Fraction of batch jobs that expire without output")
+
+
+def config_from_args(args):
+    return FakeServiceConfig(args.doc_intel_latency, args.doc_intel_page_latency, args.poll_interval, args.gpt_latency,
+                             args.token_latency, args.throttle_rate, args.throttle_retry_after, not args.no_logprobs,
+                             args.lines_per_page, args.seed, args.batch_latency, args.batch_error_rate,
+                             args.batch_expire_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake Doc Intel and Azure OpenAI endpoints for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeServiceServer((args.host, args.port), config_from_args(args))
+    print(f"Fake services listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import metrics
+
+# Defaults for the on-disk result cache
+CACHE_PATH = os.path.join("results", "cache.sqlite")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+EVICT_EVERY_N_WRITES = 50
+# Metrics counter prefixes for per-run hit/miss counts
+CACHE_HIT_COUNTER = "cache_hits"
+CACHE_MISS_COUNTER = "cache_misses"
+
+
+def make_cache_key(*parts):
+    """Build a content-addressed key from bytes/str/number parts (e.g. image bytes, model id, prompt)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Persistent SQLite cache for Doc Intel layouts and GPT extraction results.
+
+    Values are stored as JSON under a namespace (e.g. "layout", "extraction") and a content
+    hash from make_cache_key. Entries older than max_age_seconds are dropped, and the least
+    recently used entries are evicted once the store grows past max_bytes. Safe to share
+    across worker threads.
+
+    Hits and misses are recorded as cache_hits_<namespace> / cache_misses_<namespace>
+    counters in the active metrics collector, so each run can report its own calls saved;
+    stats() holds the totals since the cache was opened.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, namespace, key):
+        """Return the cached value, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM results WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses[namespace] += 1
+                metrics.add(f"{CACHE_MISS_COUNTER}_{namespace}")
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            self._conn.commit()
+            self.hits[namespace] += 1
+        metrics.add(f"{CACHE_HIT_COUNTER}_{namespace}")
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        """Store a JSON-serializable value, evicting old entries periodically."""
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, len(payload), now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY_N_WRITES == 0:
+                self._evict(now)
+
+    def get_or_compute(self, namespace, key, compute):
+        """Return the cached value for key, calling compute() and storing its result on a miss."""
+        value = self.get(namespace, key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(namespace, key, value)
+        return value
+
+    def evict(self):
+        """Drop expired entries and trim the store to max_bytes."""
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self._conn.execute("SELECT namespace, key, size FROM results ORDER BY accessed_at").fetchall()
+            for namespace, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM results WHERE namespace = ? AND key = ?", (namespace, key))
+                total -= size
+        self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters per namespace since the cache was opened; hits are remote calls saved."""
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {ns: {"hits": self.hits[ns], "misses": self.misses[ns]} for ns in namespaces}
+
+    @staticmethod
+    def run_stats(counters):
+        """Return {namespace: {"hits", "misses"}} from a run's metrics counters (see RunMetrics.summary)."""
+        stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        for name, value in counters.items():
+            for prefix, field in ((CACHE_HIT_COUNTER, "hits"), (CACHE_MISS_COUNTER, "misses")):
+                if name.startswith(prefix + "_"):
+                    stats[name[len(prefix) + 1:]][field] += value
+        return dict(sorted(stats.items()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
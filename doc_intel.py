@@ -1,49 +1,178 @@
+import io
 import os
+import hashlib
+from functools import lru_cache
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, ContentFormat, AnalyzeResult
+from azure.ai.documentintelligence.models import (AnalyzeDocumentRequest, ContentFormat, AnalyzeResult,
+                                                  DocumentAnalysisFeature)
 from azure.storage.blob import BlobServiceClient
+import metrics
+from layout_serializer import serialize_layout, repeated_lines, token_savings, LAYOUT_TOKEN_BUDGET
 from config import AZURE_STORAGE_CONNECTION_STRING, AZURE_DOC_INTEL_ENDPOINT, AZURE_DOC_INTEL_KEY
 
-def upload_file_to_blob(container_name, local_file_path):
-    connect_str = AZURE_STORAGE_CONNECTION_STRING
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    local_file_name = os.path.basename(local_file_path)
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=local_file_name)
-    
-    with open(local_file_path, 'rb') as data:
+BLOB_CONTAINER = "sampleapp"
+# Send page bytes straight to Doc Intel by default; set to True to go through blob storage instead
+USE_BLOB_UPLOAD = False
+# "compact" sends markdown tables, checkbox states and deduplicated text within LAYOUT_TOKEN_BUDGET
+# to GPT; "verbose" keeps the original one-sentence-per-line format
+LAYOUT_FORMAT = "compact"
+# Add-on features requested with every analysis; key-value pairs fill the compact layout's
+# "Key-value pairs" section (an add-on billed on top of the layout model)
+DOC_INTEL_FEATURES = [DocumentAnalysisFeature.KEY_VALUE_PAIRS]
+
+@lru_cache(maxsize=None)
+def get_blob_service_client():
+    """Return a process-wide BlobServiceClient so connections are pooled across pages."""
+    return BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
+
+@lru_cache(maxsize=None)
+def get_document_intelligence_client():
+    """Return a process-wide DocumentIntelligenceClient so connections are pooled across calls."""
+    return DocumentIntelligenceClient(endpoint=AZURE_DOC_INTEL_ENDPOINT, credential=AzureKeyCredential(AZURE_DOC_INTEL_KEY))
+
+def upload_file_to_blob(container_name, local_file_path, data=None):
+    """Upload a file (or raw bytes named after their hash when no path is given) and return its URL."""
+    blob_service_client = get_blob_service_client()
+    if local_file_path is not None:
+        blob_name = os.path.basename(local_file_path)
+    else:
+        blob_name = hashlib.sha256(data).hexdigest()
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    with metrics.span("blob_upload"):
+        if data is not None:
+            metrics.add("upload_bytes", len(data))
             blob_client.upload_blob(data, overwrite=True)
+        else:
+            metrics.add("upload_bytes", os.path.getsize(local_file_path))
+            with open(local_file_path, 'rb') as data:
+                blob_client.upload_blob(data, overwrite=True)
     return blob_client.url
 
-def analyze_document(local_file_path):
-    formUrl = upload_file_to_blob("sampleapp", local_file_path)
-    if not formUrl:
-        return "Failed to upload file to blob storage."
-
-    document_intelligence_client = DocumentIntelligenceClient(endpoint=AZURE_DOC_INTEL_ENDPOINT, credential=AzureKeyCredential(AZURE_DOC_INTEL_KEY))
-    try:
+def _begin_analyze(source, prebuilt_model, use_blob, pages=None):
+    """Start a Doc Intel analysis from a file path or bytes and return the poller."""
+    document_intelligence_client = get_document_intelligence_client()
+    if use_blob:
+        if isinstance(source, bytes):
+            formUrl = upload_file_to_blob(BLOB_CONTAINER, None, data=source)
+        else:
+            formUrl = upload_file_to_blob(BLOB_CONTAINER, source)
         print(formUrl)
-        poller = document_intelligence_client.begin_analyze_document(
-            "prebuilt-layout",
+        return document_intelligence_client.begin_analyze_document(
+            prebuilt_model,
             AnalyzeDocumentRequest(url_source=formUrl),
             output_content_format=ContentFormat.MARKDOWN,
+            pages=pages,
+            features=DOC_INTEL_FEATURES,
         )
-        result = poller.result()
-    except Exception as e:
-        return f"Failed to analyze document: {e}"
+
+    metrics.add("upload_bytes", len(source) if isinstance(source, bytes) else os.path.getsize(source))
+    # Positional body works across SDK versions (analyze_request in betas, body in 1.0)
+    if isinstance(source, bytes):
+        return document_intelligence_client.begin_analyze_document(
+            prebuilt_model, io.BytesIO(source), content_type="application/octet-stream",
+            output_content_format=ContentFormat.MARKDOWN, pages=pages, features=DOC_INTEL_FEATURES,
+        )
+    with open(source, 'rb') as f:
+        return document_intelligence_client.begin_analyze_document(
+            prebuilt_model, f, content_type="application/octet-stream",
+            output_content_format=ContentFormat.MARKDOWN, pages=pages, features=DOC_INTEL_FEATURES,
+        )
+
+def analyze_document(source, prebuilt_model="prebuilt-layout", use_blob=None):
+    """Analyze a page image (path or bytes) with Doc Intel and return the layout as text.
+
+    By default the bytes are streamed directly to Doc Intel; pass use_blob=True (or set
+    USE_BLOB_UPLOAD) to upload to blob storage first and analyze by URL. Service errors are
+    raised (not returned as text) so callers can retry throttled and transient failures.
+    """
+    use_blob = USE_BLOB_UPLOAD if use_blob is None else use_blob
+    with metrics.span("doc_intel_analyze"):
+        poller = _begin_analyze(source, prebuilt_model, use_blob)
+        with metrics.span("doc_intel_poll"):
+            result = poller.result()
+
+    metrics.add("doc_intel_pages", len(result.pages))
+    return render_layout(result)
+
+def analyze_pdf_pages(source, prebuilt_model="prebuilt-layout", pages=None, use_blob=None):
+    """Analyze a whole PDF (path or bytes) in one Doc Intel call and return {page_number: layout text}.
+
+    pages optionally restricts the analysis to a range such as "1-3,5". Each page's text has
+    the same format analyze_document produces for a single page image, so it can be passed
+    straight to the GPT extraction for that page. Service errors are raised, as in
+    analyze_document.
+    """
+    use_blob = USE_BLOB_UPLOAD if use_blob is None else use_blob
+    with metrics.span("doc_intel_analyze"):
+        poller = _begin_analyze(source, prebuilt_model, use_blob, pages=pages)
+        with metrics.span("doc_intel_poll"):
+            result = poller.result()
+
+    metrics.add("doc_intel_pages", len(result.pages))
+    # Headers and footers repeated across the document are left out of every page
+    skip_lines = repeated_lines(result)
+    return {page.page_number: render_layout(result, page.page_number, skip_lines) for page in result.pages}
+
+def render_layout(result, page_number=None, skip_lines=frozenset()):
+    """Render a layout (or one page of it) for the GPT prompt in LAYOUT_FORMAT, recording the tokens saved."""
+    verbose = format_analyze_result(result, page_number)
+    if LAYOUT_FORMAT != "compact":
+        return verbose
+    compact = serialize_layout(result, page_number, LAYOUT_TOKEN_BUDGET, skip_lines)
+    page_label = {} if page_number is None else {"page": page_number}
+    for name, value in token_savings(verbose, compact).items():
+        metrics.add(f"layout_{name}", value, **page_label)
+    return compact
+
+def parse_page_range(pages):
+    """Expand a page range string such as "1-3,5" into a sorted list of page numbers."""
+    page_numbers = set()
+    for part in (pages or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        page_numbers.update(range(int(start), int(end or start) + 1))
+    return sorted(page_numbers)
+
+def _on_page(bounding_regions, page_number):
+    return any(region.page_number == page_number for region in bounding_regions or [])
+
+def _spans_overlap(spans, page_spans):
+    return any(span.offset < page_span.offset + page_span.length and page_span.offset < span.offset + span.length
+               for span in spans or [] for page_span in page_spans or [])
+
+def format_analyze_result(result: AnalyzeResult, page_number=None):
+    """Render a Doc Intel AnalyzeResult as the line-by-line text used in GPT prompts.
+
+    With page_number set, only that page's lines, selection marks, tables (matched by
+    bounding region) and handwriting styles (matched by span) are included.
+    """
+    pages = result.pages
+    styles = result.styles
+    tables = result.tables
+    if page_number is not None:
+        pages = [page for page in pages if page.page_number == page_number]
+        page_spans = [span for page in pages for span in page.spans or []]
+        if styles is not None:
+            styles = [style for style in styles if _spans_overlap(style.spans, page_spans)]
+        if tables is not None:
+            tables = [table for table in tables if _on_page(table.bounding_regions, page_number)]
 
     markdown_lines = []
-    if result.styles is None:
+    if styles is None:
         # Handle the None case, e.g., log an error or return an empty list
         print("Result.styles is None")
         #return markdown_lines
     else:
-        for idx, style in enumerate(result.styles):
+        for idx, style in enumerate(styles):
             markdown_lines.append(
                 f"Document contains {'handwritten' if style.is_handwritten else 'no handwritten'} content"
             )
 
-    for page in result.pages:
+    for page in pages:
         for line_idx, line in enumerate(page.lines):
             markdown_lines.append(
                 f"...Line # {line_idx} has text content '{line.content}'"
@@ -53,13 +182,16 @@ def analyze_document(local_file_path):
                 markdown_lines.append(
                     f"...Selection mark is '{selection_mark.state}' and has a confidence of {selection_mark.confidence}"
                 )
-    if result.tables is not None:
-        for table_idx, table in enumerate(result.tables):
+    if tables is not None:
+        for table_idx, table in enumerate(tables):
             markdown_lines.append(
                 f"Table # {table_idx} has {table.row_count} rows and {table.column_count} columns"
             )
 
             for cell in table.cells:
+                # Tables spanning pages keep only the cells on the requested page
+                if page_number is not None and cell.bounding_regions and not _on_page(cell.bounding_regions, page_number):
+                    continue
                 markdown_lines.append(
                     f"...Cell[{cell.row_index}][{cell.column_index}] has content '{cell.content}'"
                 )
@@ -67,6 +199,12 @@ def analyze_document(local_file_path):
     markdown_lines.append("----------------------------------------")
     return "\n".join(markdown_lines)
 
-# Example usage
-markdown_result = analyze_document(r"C:\Users\jawadamin\Downloads\appl_form_image.png")
-print(markdown_result)
\ No newline at end of file
+if __name__ == "__main__":
+    # Example usage: python doc_intel.py path/to/page.png
+    import sys
+
+    try:
+        markdown_result = analyze_document(sys.argv[1])
+    except Exception as e:
+        markdown_result = f"Failed to analyze document: {e}"
+    print(markdown_result)
@@ -0,0 +1,217 @@
+"""Deterministic cross-document field matching used before asking GPT about discrepancies.
+
+Extracted page results are flattened into (field name, value) pairs, field names are
+normalized and aligned across documents (exact match after normalization and synonyms, then
+a fuzzy match), and values are compared after type-aware normalization (dates, amounts,
+checkbox states, identifiers, names/text). Groups that can be decided locally are returned as resolved;
+only the ambiguous ones need an LLM call.
+"""
+import difflib
+import json
+import re
+import string
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from streaming_fields import StreamingFieldParser
+
+# Normalized field names that mean the same thing
+KEY_SYNONYMS = {
+    "dob": "date of birth",
+    "birth date": "date of birth",
+    "birthdate": "date of birth",
+    "ssn": "social security number",
+    "social security no": "social security number",
+    "zip": "zip code",
+    "postal code": "zip code",
+    "postcode": "zip code",
+    "phone": "phone number",
+    "telephone": "phone number",
+    "tel": "phone number",
+    "e mail": "email",
+    "email address": "email",
+    "full name": "name",
+    "applicant name": "name",
+    "pay to the order of": "payee",
+    "total": "amount",
+    "total amount": "amount",
+    "amount due": "amount",
+    "check date": "date",
+    "checkdate": "date",
+    "micr": "check number",
+}
+# Words in a normalized field name that mark it as holding an amount or a person/company name
+AMOUNT_KEY_WORDS = {"amount", "total", "subtotal", "balance", "price", "fee", "cost"}
+NAME_KEY_WORDS = {"name", "payee", "payer", "applicant", "signature", "signer", "owner", "employer"}
+FUZZY_KEY_CUTOFF = 0.85
+FUZZY_TEXT_CUTOFF = 0.9
+
+DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%m-%d-%Y", "%Y/%m/%d", "%d %B %Y", "%d %b %Y",
+                "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y")
+CHECKED_VALUES = {"checked", "yes", "y", "true", "x", "selected", "marked"}
+UNCHECKED_VALUES = {"unchecked", "no", "n", "false", "unselected", "not checked", "unmarked", "blank"}
+_AMOUNT_RE = re.compile(r"^[-+]?[$€£]?\s*[-+]?\d[\d,]*(\.\d+)?$")
+# Without an amount key, a number is only an amount when it is written like one
+_AMOUNT_MARKER_RE = re.compile(r"[$€£]|\d,\d{3}|\.\d")
+_DIGIT_RE = re.compile(r"\d")
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+_NUMBER_RE = re.compile(r"\d+")
+_PUNCTUATION = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+
+def flatten_result(result):
+    """Flatten one page result (JSON text or parsed JSON) into a list of (field name, value)."""
+    text = result if isinstance(result, str) else json.dumps(result)
+    parser = StreamingFieldParser()
+    parser.feed(text)
+    return [(field["field_name"], field["field_value"]) for field in parser.fields]
+
+
+def normalize_key(key):
+    """Lower-case a field name, drop container paths, indices and punctuation, and apply synonyms."""
+    # "applicant.address[0].zip" -> "zip"
+    key = re.sub(r"\[\d+\]", "", str(key)).split(".")[-1] or str(key)
+    key = re.sub(r"([a-z])([A-Z])", r"\1 \2", key)
+    key = " ".join(key.lower().translate(_PUNCTUATION).split())
+    return KEY_SYNONYMS.get(key, key)
+
+
+def _key_words(key):
+    return set((key or "").split())
+
+
+def normalize_value(value, key=None):
+    """Return (kind, normalized value) so equal facts written differently compare equal.
+
+    key is the normalized field name. Digit strings are amounts only when written as money
+    (currency sign, thousands separator or decimals) or under an amount key; otherwise they
+    are identifiers (zip codes, account, check and phone numbers) compared exactly, leading
+    zeros and digit order included, after dropping separators. Word order is ignored only
+    for names.
+    """
+    if value is None:
+        return "empty", None
+    if isinstance(value, bool):
+        return "checkbox", "checked" if value else "unchecked"
+    amount_key = bool(_key_words(key) & AMOUNT_KEY_WORDS)
+    if isinstance(value, float) or (isinstance(value, int) and amount_key):
+        return "amount", Decimal(str(value)).quantize(Decimal("0.01"))
+    text = " ".join(str(value).split())
+    if not text:
+        return "empty", None
+    lowered = text.lower()
+    if lowered in CHECKED_VALUES:
+        return "checkbox", "checked"
+    if lowered in UNCHECKED_VALUES:
+        return "checkbox", "unchecked"
+    if _AMOUNT_RE.match(text) and (amount_key or _AMOUNT_MARKER_RE.search(text)):
+        try:
+            return "amount", Decimal(re.sub(r"[^\d.+-]", "", text)).quantize(Decimal("0.01"))
+        except InvalidOperation:
+            pass
+    for date_format in DATE_FORMATS:
+        try:
+            return "date", datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    if _DIGIT_RE.search(text):
+        # "555-1234" == "5551234", but not "1234-555" or "2139" for "02139"
+        return "identifier", _NON_ALNUM_RE.sub("", lowered)
+    words = lowered.translate(_PUNCTUATION).split()
+    if _key_words(key) & NAME_KEY_WORDS:
+        # Names: ignore case, punctuation and word order ("Doe, John" == "John Doe")
+        return "text", " ".join(sorted(words))
+    return "text", " ".join(words)
+
+
+def align_fields(results_dict):
+    """Group fields from all documents by normalized name.
+
+    Returns (doc_names, groups) where groups maps a canonical key to
+    {"label": display name, "fuzzy": bool, "values": {doc_name: [raw values]}}.
+
+    A group holds at most one value per document: the n-th occurrence of a name within a
+    document (e.g. two "name" fields under different containers) goes to its own "name #n"
+    group. Fuzzy matching only pairs keys across documents and never keys that differ in
+    their numbers, so "Dependent 1 Name" and "Dependent 2 Name" stay apart.
+    """
+    doc_names = list(results_dict)
+    groups = {}
+    for doc_name, results in results_dict.items():
+        occurrences = defaultdict(int)
+        for result in results:
+            try:
+                fields = flatten_result(result)
+            except ValueError:
+                # Unparseable page output; the document just contributes no fields
+                continue
+            for field_name, value in fields:
+                key, label = normalize_key(field_name), str(field_name)
+                occurrences[key] += 1
+                if occurrences[key] > 1:
+                    key = f"{key} #{occurrences[key]}"
+                    if any(group["label"] == label for group in groups.values()):
+                        label = f"{label} #{occurrences[key.rsplit(' #', 1)[0]]}"
+                fuzzy = False
+                if key not in groups:
+                    candidates = [candidate for candidate, group in groups.items()
+                                  if doc_name not in group["values"]
+                                  and _NUMBER_RE.findall(candidate) == _NUMBER_RE.findall(key)]
+                    close = difflib.get_close_matches(key, candidates, n=1, cutoff=FUZZY_KEY_CUTOFF)
+                    if close:
+                        key, fuzzy = close[0], True
+                group = groups.setdefault(key, {"label": label, "fuzzy": False, "values": {}})
+                group["fuzzy"] = group["fuzzy"] or fuzzy
+                group["values"].setdefault(doc_name, []).append(value)
+    return doc_names, groups
+
+
+def compare_groups(doc_names, groups):
+    """Decide each field group locally where possible.
+
+    Returns (resolved, unresolved): resolved maps the display label to the
+    {"values": [...], "type": "consistent" | "discrepancy"} format highlight_discrepancies
+    expects; unresolved maps the label to {doc_name: value} for groups that need an LLM.
+    """
+    empty_docs = [doc_name for doc_name in doc_names
+                  if not any(doc_name in group["values"] for group in groups.values())]
+    resolved, unresolved = {}, {}
+    for key, group in groups.items():
+        # One representative value per document, in document order
+        values = [group["values"].get(doc_name, [None])[0] for doc_name in doc_names]
+        present = [value for value in values if value is not None]
+        if len(present) < 2:
+            # Only compare fields across documents; a field from a single document is a
+            # discrepancy only when another document came back empty or invalid
+            if present and empty_docs:
+                resolved[group["label"]] = {"values": values, "type": "discrepancy"}
+            continue
+
+        normalized = [normalize_value(value, key) for value in present]
+        kinds = {kind for kind, _ in normalized}
+        distinct = {normalized_value for _, normalized_value in normalized}
+        if len(present) < len(values):
+            entry_type = "discrepancy"
+        elif len(distinct) == 1:
+            entry_type = "consistent"
+        elif kinds == {"text"} and all(
+                difflib.SequenceMatcher(None, normalized[0][1], other).ratio() >= FUZZY_TEXT_CUTOFF
+                for _, other in normalized[1:]):
+            # Near-identical text (e.g. an OCR typo) is ambiguous rather than a clear mismatch
+            unresolved[group["label"]] = dict(zip(doc_names, values))
+            continue
+        elif len(kinds) == 1 and kinds <= {"date", "amount", "checkbox"} and not group["fuzzy"]:
+            entry_type = "discrepancy"
+        else:
+            unresolved[group["label"]] = dict(zip(doc_names, values))
+            continue
+        resolved[group["label"]] = {"values": values, "type": entry_type}
+    return resolved, unresolved
+
+
+def chunk_groups(unresolved, chunk_size):
+    """Split unresolved groups into dicts of at most chunk_size groups for bounded LLM calls."""
+    labels = list(unresolved)
+    return [{label: unresolved[label] for label in labels[i:i + chunk_size]}
+            for i in range(0, len(labels), chunk_size)]
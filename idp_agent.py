@@ -2,92 +2,312 @@ import streamlit as st
 from openai import AzureOpenAI
 import json
 import os
+import mimetypes
 import pdf2image
 import tempfile
 import base64
+import io
+import threading
+import contextvars
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from PIL import Image
 from config import AZURE_OPENAI_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT
-from doc_intel import analyze_document
+from doc_intel import (analyze_document, analyze_pdf_pages, parse_page_range, LAYOUT_FORMAT, LAYOUT_TOKEN_BUDGET,
+                       DOC_INTEL_FEATURES)
+from pipeline import PagePipeline, PageUpdate, call_with_retries, DOC_INTEL_CONCURRENCY, GPT_CONCURRENCY
+from field_matching import align_fields, compare_groups, chunk_groups
+from cache import ResultCache, make_cache_key, CACHE_PATH
+from streaming_fields import StreamingFieldParser
+from jobs import JobManager
+from page_triage import PageTriage, BLANK_MAX_INK, TEXT_ONLY_MIN_LINES
+import metrics
 
 # Constants
 AZURE_OPENAI_TEMP = 0
 AZURE_OPENAI_MAX_TOKENS = 2500
+DOC_INTEL_MODEL = "prebuilt-layout"
+# Unresolved field groups sent to GPT per discrepancy call
+DISCREPANCY_CHUNK_SIZE = 40
 RESULTS_DIR = "results"
+# Seconds between UI refreshes while background document jobs are running
+JOB_POLL_SECONDS = 1.0
+
+# Page rasterization settings
+RASTER_DPI = 200
+RASTER_GRAYSCALE = False
+RASTER_FORMAT = "JPEG"
+RASTER_QUALITY = 90
+RASTER_MAX_PIXELS = 2048 * 2048
+
+FORM_EXTRACTION_SYSTEM_PROMPT = "You are a helpful image analysis and data extraction assistant. You will be tasked with analyzing various images of forms, ID cards, invoices etc. and you will provide an array of key value pairs with the checkbox data, labels and field values, and additional data as applicable. Return a JSON array of key value pairs. Do not return any additional content other than the JSON array - this is a strict requirement with a penalty for violation."
+
+FORM_EXTRACTION_PROMPT = """You will perform 2 tasks: \
+   1. Extract key marked up checkboxes, filled out fields, and additional content that have been filled out or marked up in the form. \
+   2. Verify and validate that the returned list is complete and accurate without missing key details, adding any missing information back to the list and correcting any inaccuracies. You will also check against the provided markdown data to correct any mistakes. \
+
+Task 1: \
+Extract key marked up checkboxes, filled out fields, and additional content that have been filled out or marked up in the form. \
+For checkboxes, return the checkbox label and the status (checked or unchecked). If you are not sure if a checkbox is checked or unchecked, return undetermined. \
+For filled out fields, return the field label and the filled out content. \
+For additional content, return the content and the context in which it appears. \
+Ensure that the the returned list is complete and concise without missing key details. \
+
+Task 2: \
+Verify and validate that the returned list is complete and concise without missing key details or key fields/checkboxes in the form, adding any missing information back to the list. \
+Be very diligent as there is a financial penalty for missing fields/checkboxes or inaccurate values. In some cases, the data may be laid out in horizontal columns as well as vertical rows, and needs to included in both cases. \
+Pay specific attention to include fields that include personal identification information, dates, addresses, numeric values, and names. \
+You will have to cross-reference the extracted data with the provided markdown data from another OCR tool to ensure accuracy. \
+
+---------------------------------------- \
+MARKDOWN DATA: \
+{doc_intel_result} \
+MARKDOWN DATA END \
+
+Once both tasks are complete, return a JSON array containing the final key value pairs. Do not return any additional details other than the extracted key value pairs as a JSON array, as you will be penalized for doing so. If an image is not as expected, return an empty array."""
+
+# Appended to the form prompt for pages triaged to the text-only path
+TEXT_ONLY_EXTRACTION_NOTE = "No image is attached for this page; extract the fields from the markdown data only."
+
+CHECK_EXTRACTION_SYSTEM_PROMPT = "You are an assistant responsible for extracting key fields from the image of a check, with the assistance of an OCR tool. Return the output in the specified JSON format."
+
+CHECK_EXTRACTION_PROMPT = """Extract the following fields from the image of the check: \
+- CheckDate: Date the check was written. Date should be returned in the format MM/DD/YYYY. \
+- Payee: Name of the person or entity the check is made out to \
+- Amount: Amount check was paid out for, return as a 2-decimal number (verify using both numberAmount and wordAmount) \
+- MICR (4 digits): Check number, usually at the bottom of the check \
+
+In order to extract the fields reliably, follow the following steps: \
+1. Understand the OCR output and extract the key fields from the OCR markdown output. \
+2. Verify the extracted OCR fields against the image to ensure accuracy. \
+   Note: Sometimes the image contains additional detail alongside the check, so please ensure you only look at the check. \
+3. Fix any inconsistencies in the field values, and double check with the OCR output. \
+4. Return the extracted fields in the specified JSON format. \
+
+OCR Markdown Output: \
+{doc_intel_result} \
+
+Output JSON Schema: \
+file_name: Name of the file \
+fields: array of objects containing the following fields: \
+   - field_name: Name of the field \
+   - field_value: Value of the field \
+
+Return result below: \
+-------------------------------------------"""
 
 # Initialize Azure OpenAI client
-client = AzureOpenAI(azure_endpoint=AZURE_OPENAI_ENDPOINT, api_key=AZURE_OPENAI_KEY, api_version="2024-02-01")
+client = AzureOpenAI(azure_endpoint=AZURE_OPENAI_ENDPOINT, api_key=AZURE_OPENAI_KEY, api_version="2024-10-21")
 
 # Ensure results directory exists
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
-def encode_image(image_path):
-    """Encode image to base64."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# Cache of Doc Intel layouts and GPT extractions keyed by page content and model settings
+result_cache = ResultCache(CACHE_PATH)
 
-def ocr_data_from_image_form(image_path: str, doc_intel_result: str):
-    """Extract key marked up and filled out fields and checkboxes from an image of a form."""
-    base64_image = encode_image(image_path)
-    print(f"Document Intelligence Markdown output: {doc_intel_result}")
-    response = client.chat.completions.create(
-        model=AZURE_OPENAI_DEPLOYMENT,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": "You are a helpful image analysis and data extraction assistant. You will be tasked with analyzing various images of forms, ID cards, invoices etc. and you will provide an array of key value pairs with the checkbox data, labels and field values, and additional data as applicable. Return a JSON array of key value pairs. Do not return any additional content other than the JSON array - this is a strict requirement with a penalty for violation."},
-            {"role": "user", "content": [
-                {"type": "text", "text": 
-                 """You will perform 2 tasks: \
-                    1. Extract key marked up checkboxes, filled out fields, and additional content that have been filled out or marked up in the form. \
-                    2. Verify and validate that the returned list is complete and accurate without missing key details, adding any missing information back to the list and correcting any inaccuracies. You will also check against the provided markdown data to correct any mistakes. \
-
-                 Task 1: \
-                 Extract key marked up checkboxes, filled out fields, and additional content that have been filled out or marked up in the form. \
-                 For checkboxes, return the checkbox label and the status (checked or unchecked). If you are not sure if a checkbox is checked or unchecked, return undetermined. \
-                 For filled out fields, return the field label and the filled out content. \
-                 For additional content, return the content and the context in which it appears. \
-                 Ensure that the the returned list is complete and concise without missing key details. \
-                
-                 Task 2: \
-                 Verify and validate that the returned list is complete and concise without missing key details or key fields/checkboxes in the form, adding any missing information back to the list. \
-                 Be very diligent as there is a financial penalty for missing fields/checkboxes or inaccurate values. In some cases, the data may be laid out in horizontal columns as well as vertical rows, and needs to included in both cases. \
-                 Pay specific attention to include fields that include personal identification information, dates, addresses, numeric values, and names. \
-                 You will have to cross-reference the extracted data with the provided markdown data from another OCR tool to ensure accuracy. \
-                 
-                 ---------------------------------------- \
-                 MARKDOWN DATA: \
-                 f{doc_intel_result} \
-                 MARKDOWN DATA END \
-                
-                 Once both tasks are complete, return a JSON array containing the final key value pairs. Do not return any additional details other than the extracted key value pairs as a JSON array, as you will be penalized for doing so. If an image is not as expected, return an empty array."""},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-            ]}
-        ],
-        temperature=AZURE_OPENAI_TEMP,
-        max_tokens=AZURE_OPENAI_MAX_TOKENS
-    )
+def encode_image(image):
+    """Encode image bytes (or an image file) to base64."""
+    if isinstance(image, bytes):
+        return base64.b64encode(image).decode('utf-8')
+    with open(image, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
 
-    return response.choices[0].message.content
+def form_extraction_messages(page_image, doc_intel_result: str, include_image=True):
+    """Build the chat messages for extracting form fields from a page image and its layout.
+
+    With include_image=False only the layout text is sent (the text-only triage path).
+    """
+    prompt = FORM_EXTRACTION_PROMPT.format(doc_intel_result=doc_intel_result)
+    if not include_image:
+        return [
+            {"role": "system", "content": FORM_EXTRACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": [{"type": "text", "text": f"{prompt}\n{TEXT_ONLY_EXTRACTION_NOTE}"}]}
+        ]
+    base64_image = encode_image(page_image.data)
+    metrics.add("image_payload_bytes", len(base64_image))
+    return [
+        {"role": "system", "content": FORM_EXTRACTION_SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": f"data:{page_image.mime_type};base64,{base64_image}"}}
+        ]}
+    ]
+
+def check_extraction_messages(page_image, doc_intel_result: str):
+    """Build the chat messages for extracting check fields from an image and its OCR layout."""
+    base64_image = encode_image(page_image.data)
+    metrics.add("image_payload_bytes", len(base64_image))
+    return [
+        {"role": "system", "content": CHECK_EXTRACTION_SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "text", "text": CHECK_EXTRACTION_PROMPT.format(doc_intel_result=doc_intel_result)},
+            {"type": "image_url", "image_url": {"url": f"data:{page_image.mime_type};base64,{base64_image}"}}
+        ]}
+    ]
+
+def stream_extraction(messages, on_field=None):
+    """Stream a JSON chat completion with logprobs through a StreamingFieldParser and return the parser."""
+    parser = StreamingFieldParser(on_field=on_field)
+    with metrics.span("gpt_extract"):
+        stream = client.chat.completions.create(
+            model=AZURE_OPENAI_DEPLOYMENT,
+            response_format={"type": "json_object"},
+            messages=messages,
+            temperature=AZURE_OPENAI_TEMP,
+            max_tokens=AZURE_OPENAI_MAX_TOKENS,
+            logprobs=True,
+            stream=True,
+            # The final chunk then carries token usage for the whole completion
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            parser.feed_chunk(chunk)
+            if getattr(chunk, "usage", None) is not None:
+                metrics.record_usage(chunk.usage)
+    return parser
+
+def stream_fields_from_image_form(page_image, doc_intel_result: str, on_field=None, include_image=True):
+    """Stream the form extraction, calling on_field(field) with its confidence as each value closes.
+
+    Returns {"content": completion text, "fields": [{field_name, field_value, field_confidence}]}.
+    """
+    parser = stream_extraction(form_extraction_messages(page_image, doc_intel_result, include_image), on_field)
+    return {"content": parser.text, "fields": parser.fields}
+
+def extract_check_fields(page_image, doc_intel_result: str, on_field=None):
+    """Extract CheckDate, Payee, Amount and MICR from a check image as {"file_name", "fields"} with confidences."""
+    parser = stream_extraction(check_extraction_messages(page_image, doc_intel_result), on_field)
+    return parser.file_fields()
+
+def cached_analyze_document(page_image):
+    """Run Doc Intel layout analysis, reusing a cached result for identical page images."""
+    key = make_cache_key(page_image.data, DOC_INTEL_MODEL, LAYOUT_FORMAT, LAYOUT_TOKEN_BUDGET,
+                         ",".join(DOC_INTEL_FEATURES))
+    doc_intel_result = result_cache.get("layout", key)
+    if doc_intel_result is None:
+        doc_intel_result = analyze_document(page_image.data, DOC_INTEL_MODEL)
+        result_cache.set("layout", key, doc_intel_result)
+    return doc_intel_result
+
+def cached_stream_fields_from_image_form(page_image, doc_intel_result, on_field=None, include_image=True):
+    """Stream the form extraction, reusing a cached result (with confidences) when available."""
+    # Text-only extractions get their own keys; image extractions keep the existing ones
+    text_only = () if include_image else (TEXT_ONLY_EXTRACTION_NOTE,)
+    key = make_cache_key(page_image.data, AZURE_OPENAI_DEPLOYMENT, FORM_EXTRACTION_SYSTEM_PROMPT,
+                         FORM_EXTRACTION_PROMPT, AZURE_OPENAI_TEMP, doc_intel_result, *text_only)
+    return result_cache.get_or_compute(
+        "streamed_extraction", key,
+        lambda: stream_fields_from_image_form(page_image, doc_intel_result, on_field, include_image))
+
+def cached_extract_check_fields(page_image, doc_intel_result):
+    """Extract check fields, reusing a cached result for identical image, layout, model and prompt."""
+    key = make_cache_key(page_image.data, AZURE_OPENAI_DEPLOYMENT, CHECK_EXTRACTION_SYSTEM_PROMPT,
+                         CHECK_EXTRACTION_PROMPT, AZURE_OPENAI_TEMP, doc_intel_result)
+    return result_cache.get_or_compute("check_extraction", key,
+                                       lambda: extract_check_fields(page_image, doc_intel_result))
+
+def cached_analyze_pdf_pages(pdf_path, pages=None):
+    """Run whole-PDF Doc Intel layout analysis once, reusing a cached per-page result for identical PDFs."""
+    with open(pdf_path, "rb") as pdf_file:
+        pdf_bytes = pdf_file.read()
+    key = make_cache_key(pdf_bytes, DOC_INTEL_MODEL, pages or "", LAYOUT_FORMAT, LAYOUT_TOKEN_BUDGET,
+                         ",".join(DOC_INTEL_FEATURES))
+    page_layouts = result_cache.get("document_layout", key)
+    if page_layouts is None:
+        page_layouts = analyze_pdf_pages(pdf_bytes, DOC_INTEL_MODEL, pages=pages)
+        if page_layouts:
+            result_cache.set("document_layout", key, page_layouts)
+    # JSON round-trips through the cache turn page numbers into strings
+    return {int(page_number): text for page_number, text in page_layouts.items()}
+
+class DocumentLayout:
+    """Analyzes a whole PDF on first use and hands out the layout text of each page.
+
+    The page that triggers the analysis owns it: throttled and transient failures are
+    retried (honoring Retry-After) while it holds the lock, so the other pages wait for that
+    one result instead of resubmitting the whole PDF. A failure that outlasts the retries is
+    remembered and raised for every page as a non-retryable error.
+    """
+
+    def __init__(self, pdf_path, pages=None, doc_intel_slots=None):
+        self.pdf_path = pdf_path
+        self.pages = pages
+        self.doc_intel_slots = doc_intel_slots
+        self._lock = threading.Lock()
+        self._page_layouts = None
+        self._error = None
+
+    def page(self, page_number):
+        # Pages of the same document wait here for the single Doc Intel call to finish;
+        # its metrics belong to the document rather than the page that happened to trigger it
+        with self._lock, metrics.labels(page=None):
+            if self._page_layouts is None and self._error is None:
+                try:
+                    self._page_layouts = call_with_retries(self._analyze)
+                except Exception as e:
+                    self._error = e
+            if self._error is not None:
+                raise RuntimeError(f"Doc Intel analysis of the whole PDF failed: {self._error}") from self._error
+        if page_number not in self._page_layouts:
+            raise RuntimeError(f"Doc Intel returned no layout for page {page_number}")
+        return self._page_layouts[page_number]
+
+    def _analyze(self):
+        # One slot per attempt, so a backoff between attempts doesn't hold up other documents
+        if self.doc_intel_slots is None:
+            return cached_analyze_pdf_pages(self.pdf_path, self.pages)
+        with self.doc_intel_slots:
+            return cached_analyze_pdf_pages(self.pdf_path, self.pages)
+
+def classify_field_groups(field_groups):
+    """Ask GPT whether each group of per-document values is consistent; returns {label: type}."""
+    with metrics.span("gpt_classify"):
+        response = client.chat.completions.create(
+            model=AZURE_OPENAI_DEPLOYMENT,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that validates the consistency in extracted data from multiple documents. You will be given groups of values that were extracted for the same field from different documents, and decide for each group whether the values refer to the same information (ignoring formatting, abbreviations and minor OCR errors) or not. Return only a JSON object mapping each field label, exactly as given, to either 'consistent' or 'discrepancy' - this is a strict requirement with a penalty for violation."},
+                {"role": "user", "content": f"Classify each of the following field groups. Each group maps document names to the value extracted from that document (null when the document has no value):\n\n{json.dumps(field_groups)}"}
+            ],
+            temperature=AZURE_OPENAI_TEMP,
+            max_tokens=AZURE_OPENAI_MAX_TOKENS
+        )
+    metrics.record_usage(response.usage)
+    return json.loads(response.choices[0].message.content)
 
 def detect_discrepancies(results_dict):
-    """Detect discrepancies in extracted data."""
-    all_results = []
-    for doc_name, results in results_dict.items():
-        all_results.extend(results)
-    
-    response = client.chat.completions.create(
-        model=AZURE_OPENAI_DEPLOYMENT,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that validates the consistency in extracted data from multiple documents. You will compare the extracted data and highlight any discrepancies. You will return a JSON object listing the most important key value pairs (with one value for each document as applicable, returned as an array of values under the key) with an additional field marked 'type' with value as either 'discrepancy' or 'consistent' to indicate if the data is consistent or not. Do not return any additional content other than the list of key value pairs - this is a strict requirement with a penalty for violation."},
-            {"role": "user", "content": f"Compare the following extracted data and highlight discrepancies as a JSON object highlighting key value pairs and discrepancies:\n\n{json.dumps(all_results)}. Only compare fields between two documents, not within the same document. The results JSON is structured to have each document as one JSON object with the key value pairs within an array, and therefore you should compare fields across multiple document objects, and not within the same array. If any of the documents is empty or invalid, use the keys from the other document(s) and mark them as discrepancies. Double check the list and only include the most important key value pairs, preferably no more than 10-15 pairs."}
-        ],
-        temperature=AZURE_OPENAI_TEMP,
-        max_tokens=AZURE_OPENAI_MAX_TOKENS
-    )
-
-    discrepancies_json = response.choices[0].message.content
-    discrepancies_dict = json.loads(discrepancies_json)  # Parse JSON string into dictionary
-    return discrepancies_dict
+    """Detect discrepancies in extracted data.
+
+    Fields are aligned and compared across documents locally; only the groups that can't be
+    decided deterministically are sent to GPT, in chunks of DISCREPANCY_CHUNK_SIZE.
+    """
+    with metrics.span("detect_discrepancies"):
+        doc_names, field_groups = align_fields(results_dict)
+        discrepancies_dict, unresolved = compare_groups(doc_names, field_groups)
+
+        chunks = chunk_groups(unresolved, DISCREPANCY_CHUNK_SIZE)
+        with ThreadPoolExecutor(max_workers=GPT_CONCURRENCY) as executor:
+            # Each call runs in a copy of this context so its spans and tokens reach the active metrics
+            futures = [executor.submit(contextvars.copy_context().run, call_with_retries, classify_field_groups, chunk)
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    types = future.result()
+                except Exception as e:
+                    print(f"Failed to classify field groups: {e}")
+                    types = {}
+                for label, values_by_doc in chunk.items():
+                    entry_type = types.get(label)
+                    discrepancies_dict[label] = {
+                        "values": [values_by_doc[doc_name] for doc_name in doc_names],
+                        # Anything GPT couldn't classify is surfaced for review
+                        "type": entry_type if entry_type in ("consistent", "discrepancy") else "discrepancy",
+                    }
+
+    # Discrepancies first so they are at the top of the sidebar
+    return dict(sorted(discrepancies_dict.items(), key=lambda item: item[1]["type"] != "discrepancy"))
 
 def highlight_discrepancies(discrepancies_dict):
     """Highlight discrepancies with Markdown, handling None values and making them line by line."""
@@ -103,15 +323,227 @@ def highlight_discrepancies(discrepancies_dict):
 
 
 
-def split_pdf_to_images(pdf_path):
-    """Split PDF into images."""
-    images = pdf2image.convert_from_path(pdf_path)
-    image_paths = []
-    for i, image in enumerate(images):
-        temp_image_path = os.path.join(tempfile.gettempdir(), f"page_{i}.png")
-        image.save(temp_image_path, 'PNG')
-        image_paths.append(temp_image_path)
-    return image_paths
+PageImage = namedtuple("PageImage", ["page_number", "data", "mime_type"])
+
+def rasterize_page(image, grayscale=RASTER_GRAYSCALE, image_format=RASTER_FORMAT, quality=RASTER_QUALITY,
+                   max_pixels=RASTER_MAX_PIXELS):
+    """Encode a PIL page image to bytes, downscaling it to fit within max_pixels."""
+    if max_pixels and image.width * image.height > max_pixels:
+        scale = (max_pixels / (image.width * image.height)) ** 0.5
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+    if grayscale:
+        image = image.convert("L")
+    elif image_format.upper() == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if image_format.upper() == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, image_format.upper(), optimize=True)
+    return buffer.getvalue()
+
+def iter_pdf_pages(pdf_path, page_numbers=None, dpi=RASTER_DPI, grayscale=RASTER_GRAYSCALE, image_format=RASTER_FORMAT,
+                   quality=RASTER_QUALITY, max_pixels=RASTER_MAX_PIXELS, document=None):
+    """Rasterize a PDF one page at a time, yielding in-memory PageImage buffers.
+
+    Only one full-resolution page is held in memory at a time and nothing is written to
+    disk. page_numbers optionally restricts which (1-based) pages are rendered; document
+    names the PDF in recorded metrics.
+    """
+    mime_type = Image.MIME.get(image_format.upper(), f"image/{image_format.lower()}")
+    if page_numbers is None:
+        page_numbers = range(1, get_pdf_page_count(pdf_path) + 1)
+    for page_number in page_numbers:
+        with metrics.span("rasterize", document=document, page=page_number):
+            images = pdf2image.convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number,
+                                                 grayscale=grayscale)
+            page_images = []
+            for image in images:
+                page_images.append(PageImage(page_number, rasterize_page(image, grayscale, image_format, quality,
+                                                                         max_pixels), mime_type))
+                image.close()
+        for page_image in page_images:
+            metrics.add("raster_bytes", len(page_image.data), document=document, page=page_number)
+            yield page_image
+
+def get_pdf_page_count(pdf_path):
+    """Return the number of pages in a PDF without rendering it."""
+    return pdf2image.pdfinfo_from_path(pdf_path)["Pages"]
+
+def format_streaming_fields(streaming):
+    """Render fields of a document's in-flight pages, streamed so far, as markdown."""
+    lines = []
+    for page_number in sorted(streaming):
+        lines.append(f"**Page {page_number}** (extracting...)")
+        for field in streaming[page_number]:
+            confidence = field["field_confidence"]
+            confidence_str = f" ({confidence:.0%})" if confidence is not None else ""
+            lines.append(f"- {field['field_name']}: {field['field_value']}{confidence_str}")
+    return "\n".join(lines)
+
+def process_document(job, pdf_path, page_range, analyze_whole_pdf, raster_settings,
+                     doc_intel_concurrency=DOC_INTEL_CONCURRENCY, gpt_concurrency=GPT_CONCURRENCY,
+                     triage_settings=None, service_slots=None):
+    """Background job: run the page pipeline over one PDF, recording progress in job.state.
+
+    job.state holds page_numbers, completed ({page_number: (preview path, result, error)}),
+    streaming ({page_number: [fields]}), triage (pages skipped or sent text-only, with
+    their scores), metrics and, once finished, results (the page contents in page order).
+    Page images are written to a pages directory next to the PDF as they finish, so a job
+    only holds references to them. triage_settings are PageTriage keyword arguments; None
+    disables triage. service_slots is an optional (Doc Intel, GPT) semaphore pair shared
+    with other jobs (see get_service_slots).
+    """
+    doc_intel_slots, gpt_slots = service_slots or (None, None)
+    run_metrics = metrics.RunMetrics()
+    triage = PageTriage(**triage_settings) if triage_settings is not None else None
+    selected_pages = set(parse_page_range(page_range))
+    page_numbers = [page_number for page_number in range(1, get_pdf_page_count(pdf_path) + 1)
+                    if not selected_pages or page_number in selected_pages]
+    preview_dir = os.path.join(os.path.dirname(pdf_path), "pages")
+    os.makedirs(preview_dir, exist_ok=True)
+    with job.lock:
+        job.state.update(pdf_path=pdf_path, page_numbers=page_numbers, completed={}, streaming={},
+                         triage=triage.decisions if triage else {}, metrics=run_metrics)
+
+    def save_preview(page_image):
+        extension = mimetypes.guess_extension(page_image.mime_type) or ".img"
+        preview_path = os.path.join(preview_dir, f"page_{page_image.page_number:04d}{extension}")
+        with open(preview_path, "wb") as preview_file:
+            preview_file.write(page_image.data)
+        return preview_path
+
+    def analyze_page(page_image):
+        if analyze_whole_pdf:
+            return layout.page(page_image.page_number)
+        return cached_analyze_document(page_image)
+
+    def extract_page(page_image, doc_intel_result):
+        decision = triage.route(page_image, doc_intel_result) if triage else None
+        if decision and decision.action == "skip":
+            metrics.add("pages_skipped")
+            return {"content": "", "fields": []}
+        return cached_stream_fields_from_image_form(page_image, doc_intel_result,
+                                                    on_field=lambda field: pipeline.report(page_image, field),
+                                                    include_image=not (decision and decision.action == "text_only"))
+
+    def screened_pages():
+        # Rasterize lazily so only the pages in flight are held in memory
+        for page_image in iter_pdf_pages(pdf_path, page_numbers, document=job.name, **raster_settings):
+            if triage and triage.screen(page_image).action == "skip":
+                metrics.add("pages_skipped", document=job.name, page=page_image.page_number)
+                with job.lock:
+                    job.state["completed"][page_image.page_number] = (None, None, None)
+                    job.progress = len(job.state["completed"]) / len(page_numbers)
+                continue
+            yield page_image
+
+    pipeline = PagePipeline(
+        analyze_page,
+        extract_page,
+        doc_intel_concurrency=doc_intel_concurrency,
+        gpt_concurrency=gpt_concurrency,
+        # Whole-PDF layouts take a Doc Intel slot only for the one shared call per document
+        limit_analyze=not analyze_whole_pdf,
+        page_labels=lambda page_image: {"document": job.name, "page": page_image.page_number},
+        doc_intel_slots=doc_intel_slots,
+        gpt_slots=gpt_slots,
+    )
+    layout = DocumentLayout(pdf_path, page_range, pipeline.doc_intel_slots)
+
+    with metrics.use_metrics(run_metrics):
+        for event in pipeline.run(screened_pages()):
+            if isinstance(event, PageUpdate):
+                page_image, field = event
+                with job.lock:
+                    job.state["streaming"].setdefault(page_image.page_number, []).append(field)
+                continue
+            _, page_image, _, result, error = event
+            if error is not None:
+                print(f"Failed to process page {page_image.page_number} of {job.name}: {error}")
+            # Keep only a path to the page image so finished jobs don't pin every page in memory
+            preview_path = save_preview(page_image) if error is None else None
+            with job.lock:
+                job.state["streaming"].pop(page_image.page_number, None)
+                job.state["completed"][page_image.page_number] = (preview_path, result, error)
+                job.progress = len(job.state["completed"]) / len(page_numbers)
+
+    with job.lock:
+        completed = job.state["completed"]
+        job.state["results"] = [completed[page_number][1]["content"] for page_number in page_numbers
+                                if page_number in completed and completed[page_number][1]
+                                and completed[page_number][1]["content"]]
+        skipped = [decision for decision in job.state["triage"].values() if decision["action"] == "skip"]
+        if not job.state["results"] and len(skipped) < len(page_numbers):
+            raise RuntimeError("no page could be extracted")
+
+@st.cache_resource
+def get_service_slots(doc_intel_concurrency, gpt_concurrency):
+    """Process-wide (Doc Intel, GPT) semaphores, so the sidebar limits hold across all running jobs."""
+    return threading.Semaphore(doc_intel_concurrency), threading.Semaphore(gpt_concurrency)
+
+@st.cache_resource
+def get_job_manager():
+    """Process-wide registry of background document jobs, shared across reruns and sessions."""
+    return JobManager()
+
+def render_job(job):
+    """Render a document job's status and the pages finished so far, in page order."""
+    status, progress, error, state = job.snapshot()
+    with st.expander(f"Document: {job.name}", expanded=True):
+        if status == "completed":
+            st.text("Status: Completed")
+        elif status == "failed":
+            st.text(f"Status: Failed ({error})")
+        else:
+            st.text("Status: In Progress")
+
+        if "pdf_path" in state:
+            pdf_url = generate_temp_url(state["pdf_path"])
+            st.markdown(f'<a href="{pdf_url}" target="blah">Open PDF in New Tab</a>', unsafe_allow_html=True)
+        st.progress(progress)
+
+        for page_number in state.get("page_numbers", []):
+            if page_number not in state["completed"]:
+                break
+            preview_path, result, page_error = state["completed"][page_number]
+            decision = state.get("triage", {}).get(page_number)
+            if decision and decision["action"] == "skip":
+                st.caption(f"Page {page_number} skipped: {decision['reason']}")
+            elif page_error is not None:
+                st.warning(f"Page {page_number} failed after retries: {page_error}")
+            elif result and result["content"]:
+                if decision and decision["action"] == "text_only":
+                    st.caption(f"Page {page_number} extracted from layout text only ({decision['reason']})")
+                st.subheader(f"Page {page_number}")
+                st.image(preview_path, caption=f"Page {page_number} Preview", use_column_width=True)
+                st.json(result["content"])
+                if result["fields"]:
+                    st.caption("Field confidence")
+                    st.dataframe(result["fields"], use_container_width=True)
+
+        streaming = {page_number: list(fields) for page_number, fields in state.get("streaming", {}).items()}
+        if streaming:
+            st.markdown(format_streaming_fields(streaming))
+
+def finish_run(jobs):
+    """Detect discrepancies across finished document jobs and save the run; returns the run summary."""
+    results_dict = {job.name: job.state["results"] for job in jobs if job.status == "completed"}
+    triage_dict = {job.name: dict(job.state["triage"]) for job in jobs if job.state.get("triage")}
+    run_metrics = metrics.merged([job.state["metrics"] for job in jobs if "metrics" in job.state])
+    with metrics.use_metrics(run_metrics):
+        discrepancies_dict = detect_discrepancies(results_dict)
+    metrics_summary = run_metrics.summary()
+
+    # Save results, discrepancies and metrics to a JSON file with a timestamp
+    if results_dict:
+        run_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        with open(os.path.join(RESULTS_DIR, f"run_{run_date}.json"), "w") as f:
+            json.dump({"results": results_dict, "discrepancies": discrepancies_dict, "metrics": metrics_summary,
+                       "triage": triage_dict}, f)
+
+    return {"discrepancies": discrepancies_dict, "metrics": metrics_summary, "triage": triage_dict,
+            "metrics_prometheus": run_metrics.to_prometheus(), "metrics_jsonl": run_metrics.to_jsonl()}
 
 def generate_temp_url(file_path):
     """Generate a temporary URL for the PDF file."""
@@ -129,55 +561,102 @@ def main():
     with col1:
         uploaded_files = st.file_uploader("Upload your PDF files here", type=["pdf"], accept_multiple_files=True)
 
+    st.sidebar.title("Settings")
+    doc_intel_concurrency = st.sidebar.slider("Doc Intel concurrency", 1, 16, DOC_INTEL_CONCURRENCY)
+    gpt_concurrency = st.sidebar.slider("GPT concurrency", 1, 16, GPT_CONCURRENCY)
+    analyze_whole_pdf = st.sidebar.checkbox("Analyze whole PDF in one Doc Intel call", value=True)
+    page_range = st.sidebar.text_input("Page range (e.g. 1-3,5; empty for all pages)").strip() or None
+    raster_settings = {
+        "dpi": st.sidebar.slider("Rasterization DPI", 72, 300, RASTER_DPI),
+        "grayscale": st.sidebar.checkbox("Grayscale page images", value=RASTER_GRAYSCALE),
+        "image_format": st.sidebar.selectbox("Page image format", ["JPEG", "PNG"], index=["JPEG", "PNG"].index(RASTER_FORMAT)),
+        "quality": st.sidebar.slider("JPEG quality", 50, 100, RASTER_QUALITY),
+        "max_pixels": int(st.sidebar.number_input("Max megapixels per page", 0.5, 50.0, RASTER_MAX_PIXELS / 1e6) * 1e6),
+    }
+    triage_settings = None
+    if st.sidebar.checkbox("Skip blank/duplicate pages and send text-heavy pages without the image", value=False):
+        triage_settings = {
+            "blank_max_ink": st.sidebar.number_input("Blank page max ink share", 0.0, 0.1, BLANK_MAX_INK, step=0.0001,
+                                                     format="%.4f"),
+            "skip_duplicates": st.sidebar.checkbox("Skip pages identical to an earlier page", value=True),
+            "text_only_min_lines": st.sidebar.number_input("Text-only min plain text lines (0 disables)", 0, 1000,
+                                                           TEXT_ONLY_MIN_LINES),
+        }
+
     if uploaded_files:
-        results_dict = {}
+        job_manager = get_job_manager()
+        # Per-session directory so concurrent sessions uploading the same file name don't collide
+        if "upload_dir" not in st.session_state:
+            st.session_state["upload_dir"] = tempfile.mkdtemp(prefix="idp_upload_")
+        upload_dir = st.session_state["upload_dir"]
+        jobs = []
         for uploaded_file in uploaded_files:
-            expander = st.expander(f"Document: {uploaded_file.name}", expanded=True)
-            with expander:
-                status = st.text("Status: In Progress")
-                results = []
-
-                pdf_path = os.path.join(tempfile.gettempdir(), uploaded_file.name)
+            data = uploaded_file.getvalue()
+            # Same bytes and output-affecting settings -> same job, however often the script reruns
+            job_id = make_cache_key(data, page_range or "", analyze_whole_pdf, json.dumps(raster_settings, sort_keys=True),
+                                    json.dumps(triage_settings, sort_keys=True))
+            job = job_manager.get(job_id)
+            if job is None:
+                pdf_path = os.path.join(upload_dir, job_id[:16], uploaded_file.name)
+                os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
                 with open(pdf_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-
-                pdf_url = generate_temp_url(pdf_path)
-                st.markdown(f'<a href="{pdf_url}" target="blah">Open PDF in New Tab</a>', unsafe_allow_html=True)
-
-                image_paths = split_pdf_to_images(pdf_path)
-                progress_bar = st.progress(0)
-
-                for page_number, image_path in enumerate(image_paths, start=1):
-                    doc_intel_result = analyze_document(image_path)
-                    result = ocr_data_from_image_form(image_path, doc_intel_result)
-                    if result:
-                        results.append(result)
-                        st.subheader(f"Page {page_number}")
-                        st.image(image_path, caption=f"Page {page_number} Preview", use_column_width=True)
-                        st.json(result)
-
-                    progress_bar.progress(page_number / len(image_paths))
-
-                if results:
-                    status.text("Status: Completed")
-                    results_dict[uploaded_file.name] = results
-                else:
-                    status.text("Status: Failed")
-
-        discrepancies_dict = detect_discrepancies(results_dict)
-        highlighted_discrepancies = highlight_discrepancies(discrepancies_dict)
+                    f.write(data)
+                job = job_manager.submit(job_id, uploaded_file.name, process_document, pdf_path, page_range,
+                                         analyze_whole_pdf, raster_settings, doc_intel_concurrency, gpt_concurrency,
+                                         triage_settings, get_service_slots(doc_intel_concurrency, gpt_concurrency))
+            jobs.append(job)
+
+        for job in jobs:
+            render_job(job)
+
+        if not all(job.done for job in jobs):
+            # Poll: widget interactions rerun the script immediately, otherwise refresh shortly
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
+
+        # Discrepancy detection and saving happen once per set of finished jobs, not on every rerun
+        finished_runs = st.session_state.setdefault("finished_runs", {})
+        run_key = tuple(job.job_id for job in jobs)
+        if run_key not in finished_runs:
+            finished_runs[run_key] = finish_run(jobs)
+        run = finished_runs[run_key]
+        highlighted_discrepancies = highlight_discrepancies(run["discrepancies"])
+
+        st.sidebar.title("Cache")
+        # Hits and misses of this run only; result_cache.stats() spans every session of the process
+        for namespace, counts in ResultCache.run_stats(run["metrics"]["counters"]).items():
+            st.sidebar.write(f"{namespace}: {counts['hits']} hits / {counts['misses']} misses "
+                             f"({counts['hits']} calls saved)")
+
+        metrics_summary = run["metrics"]
+        st.sidebar.title("Metrics")
+        st.sidebar.write(f"Wall time: {metrics_summary['wall_seconds']:.1f}s, "
+                         f"estimated cost: ${metrics_summary['estimated_cost_usd']:.4f}")
+        st.sidebar.dataframe([{"stage": stage, **stats} for stage, stats in metrics_summary["stages"].items()],
+                             use_container_width=True)
+        st.sidebar.json(metrics_summary["counters"])
+        layout_tokens = [{"page": page, **{name: stats["counters"][f"layout_{name}"]
+                                           for name in ("verbose_tokens", "compact_tokens", "saved_tokens")}}
+                         for page, stats in metrics_summary["pages"].items()
+                         if "layout_saved_tokens" in stats["counters"]]
+        if layout_tokens:
+            st.sidebar.caption("Layout prompt tokens per page")
+            st.sidebar.dataframe(layout_tokens, use_container_width=True)
+        st.sidebar.download_button("Download metrics (Prometheus)", run["metrics_prometheus"], "metrics.prom")
+        st.sidebar.download_button("Download metrics (JSON lines)", run["metrics_jsonl"], "metrics.jsonl")
+
+        if run["triage"]:
+            st.sidebar.title("Triage")
+            st.sidebar.dataframe([{"document": document_name, "page": page_number, **decision}
+                                  for document_name, decisions in run["triage"].items()
+                                  for page_number, decision in sorted(decisions.items())],
+                                 use_container_width=True)
 
         # Display discrepancies in the sidebar
         st.sidebar.title("Validation")
         if highlighted_discrepancies:
             st.sidebar.markdown(highlighted_discrepancies)
 
-        # Save results and discrepancies to a JSON file with a timestamp
-        if results_dict:
-            run_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            with open(os.path.join(RESULTS_DIR, f"run_{run_date}.json"), "w") as f:
-                json.dump({"results": results_dict, "discrepancies": discrepancies_dict}, f)
-
     # Handle displaying previous runs
     elif selected_run:
         st.sidebar.write(f"Displaying results for: {selected_run}")
@@ -185,6 +664,7 @@ def main():
             old_data = json.load(f)
         old_results = old_data.get("results", {})
         old_discrepancies = old_data.get("discrepancies", {})
+        old_metrics = old_data.get("metrics")
 
         for document_name, results in old_results.items():
             st.subheader(f"Document: {document_name}")
@@ -198,5 +678,11 @@ def main():
             st.sidebar.title("Discrepancies")
             st.sidebar.markdown(highlighted_discrepancies)
 
+        if old_metrics:
+            st.sidebar.title("Metrics")
+            st.sidebar.dataframe([{"stage": stage, **stats} for stage, stats in old_metrics["stages"].items()],
+                                 use_container_width=True)
+            st.sidebar.json(old_metrics["counters"])
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+"""Background jobs that keep running across Streamlit script reruns.
+
+Streamlit re-executes the whole script on every widget interaction, so long-running work is
+handed to a JobManager instead: each job runs on a worker thread and writes its progress
+into a Job object, which the script reads on every rerun to render what is done so far.
+Jobs are keyed by an id (e.g. a hash of the upload and its processing settings), and
+submitting a known id returns the existing job instead of starting the work again.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Jobs processed at the same time; their page pipelines share the process-wide service limits,
+# so this mostly bounds how many documents are rasterized at once
+JOB_WORKERS = 8
+# Finished jobs kept for re-rendering before the oldest are dropped
+MAX_FINISHED_JOBS = 50
+
+JOB_STATUSES = ("queued", "running", "completed", "failed")
+
+
+class Job:
+    """State of one background job.
+
+    The worker updates status, progress and the job-specific state dict while holding
+    lock; readers take the same lock (or call snapshot()) to get a consistent view.
+    """
+
+    def __init__(self, job_id, name):
+        self.job_id = job_id
+        self.name = name
+        self.status = "queued"
+        self.progress = 0.0
+        self.error = None
+        self.state = {}
+        self.created_at = time.time()
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+
+    def snapshot(self):
+        """Return (status, progress, error, shallow copy of state) taken under the lock."""
+        with self.lock:
+            return self.status, self.progress, self.error, {
+                key: value.copy() if isinstance(value, (dict, list)) else value for key, value in self.state.items()
+            }
+
+
+class JobManager:
+    """Runs jobs on a small thread pool and remembers them by id."""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(self, job_id, name, fn, *args, **kwargs):
+        """Start fn(job, *args, **kwargs) in the background unless job_id is already known; return the Job.
+
+        fn reports progress through the job it is given; its return value is ignored. If it
+        raises, the job is marked failed with the error text.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+            job = self._jobs[job_id] = Job(job_id, name)
+            self._evict()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        with job.lock:
+            job.status = "running"
+        try:
+            fn(job, *args, **kwargs)
+        except Exception as e:
+            print(f"Job {job.name} failed: {e}")
+            with job.lock:
+                job.status, job.error, job.finished_at = "failed", str(e), time.time()
+        else:
+            with job.lock:
+                job.status, job.progress, job.finished_at = "completed", 1.0, time.time()
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -0,0 +1,205 @@
+"""Compact, token-budgeted rendering of Doc Intel layout results for GPT prompts.
+
+format_analyze_result in doc_intel.py writes one verbose sentence per OCR line, table cell
+and selection mark. serialize_layout renders the same page as:
+
+- key-value pairs (when the analysis returned them) as "- key: value" lines;
+- checkboxes as "- [x] label" / "- [ ] label", labelled with the text next to each mark;
+- tables as real markdown tables;
+- the remaining text lines once each, with handwritten lines marked, and without lines
+  already covered above, duplicates, page numbers or header/footer lines repeated on most
+  pages.
+
+Sections are filled in that priority order until the token budget is spent; whatever does
+not fit is dropped and noted at the end.
+"""
+import math
+import re
+
+# Approximate tokens of a prompt string, without needing a tokenizer
+CHARS_PER_TOKEN = 4
+LAYOUT_TOKEN_BUDGET = 2000
+# A line on at least this share of a document's pages (and at least 3 pages) is boilerplate
+REPEATED_LINE_MIN_PAGES = 3
+REPEATED_LINE_MIN_SHARE = 0.5
+# Only lines within this share of the page height from the top or bottom edge can be headers/footers
+HEADER_FOOTER_BAND = 0.1
+
+_PAGE_NUMBER_RE = re.compile(r"^(page\s*)?\d+(\s*(of|/)\s*\d+)?$", re.IGNORECASE)
+_SELECTION_TOKEN_RE = re.compile(r":(un)?selected:")
+_ALNUM_RE = re.compile(r"\w")
+# "Applicant: John Doe" is a field value even when it repeats on every page
+_KEY_VALUE_RE = re.compile(r"\w.*:\s*\S")
+
+
+def estimate_tokens(text):
+    """Approximate the number of prompt tokens in text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _on_page(bounding_regions, page_number):
+    return page_number is None or any(region.page_number == page_number for region in bounding_regions or [])
+
+
+def _overlaps(spans, other_spans):
+    return any(span.offset < other.offset + other.length and other.offset < span.offset + span.length
+               for span in spans or [] for other in other_spans or [])
+
+
+def _box(polygon):
+    """Return (min x, min y, max x, max y) of a flat [x1, y1, x2, y2, ...] polygon."""
+    xs, ys = polygon[0::2], polygon[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _normalize_line(text):
+    return " ".join(_SELECTION_TOKEN_RE.sub("", text).split())
+
+
+def _is_boilerplate(text):
+    return not _ALNUM_RE.search(text) or bool(_PAGE_NUMBER_RE.match(text))
+
+
+def _in_header_footer_band(line, page):
+    if not line.polygon or not page.height:
+        return False
+    _, top, _, bottom = _box(line.polygon)
+    band = HEADER_FOOTER_BAND * page.height
+    return bottom <= band or top >= page.height - band
+
+
+def repeated_lines(result):
+    """Return the normalized header/footer lines that repeat on most pages of a multi-page result.
+
+    Only lines near the top or bottom edge of the page count, and never lines shaped like
+    "key: value", so field values repeated across pages stay in every page's layout.
+    """
+    pages = result.pages or []
+    if len(pages) < REPEATED_LINE_MIN_PAGES:
+        return frozenset()
+    counts = {}
+    for page in pages:
+        band_lines = {_normalize_line(line.content).lower() for line in page.lines or []
+                      if _in_header_footer_band(line, page)}
+        for text in band_lines:
+            if _KEY_VALUE_RE.search(text):
+                continue
+            counts[text] = counts.get(text, 0) + 1
+    threshold = max(REPEATED_LINE_MIN_PAGES, REPEATED_LINE_MIN_SHARE * len(pages))
+    return frozenset(text for text, count in counts.items() if text and count >= threshold)
+
+
+def _markdown_cell(text):
+    return " ".join((text or "").split()).replace("|", "\\|")
+
+
+def _markdown_table(table, page_number):
+    cells = [cell for cell in table.cells
+             if page_number is None or not cell.bounding_regions or _on_page(cell.bounding_regions, page_number)]
+    if not cells:
+        return None
+    rows = sorted({cell.row_index for cell in cells})
+    columns = max(table.column_count, max(cell.column_index for cell in cells) + 1)
+    grid = {row: [""] * columns for row in rows}
+    for cell in cells:
+        # Merged cells keep their content in the top-left position only
+        grid[cell.row_index][cell.column_index] = _markdown_cell(cell.content)
+    lines = [f"| {' | '.join(grid[rows[0]])} |", f"|{'---|' * columns}"]
+    lines.extend(f"| {' | '.join(grid[row])} |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def _checkbox_label(mark, lines):
+    """Find the text on the same row as a selection mark, preferring text to its right."""
+    if not mark.polygon:
+        return None
+    left, top, right, bottom = _box(mark.polygon)
+    center_y, tolerance = (top + bottom) / 2, max(bottom - top, 1e-6)
+    best = None
+    for index, line in enumerate(lines):
+        if not line.polygon:
+            continue
+        line_left, line_top, line_right, line_bottom = _box(line.polygon)
+        if abs((line_top + line_bottom) / 2 - center_y) > tolerance:
+            continue
+        # Text to the right of the box is the usual label position; text to the left costs more
+        distance = line_left - right if line_left >= left else (left - line_right) * 2 + 1
+        if best is None or distance < best[0]:
+            best = (distance, index)
+    return None if best is None else best[1]
+
+
+def _page_sections(result, page_number, skip_lines):
+    """Build the (section title, [blocks]) list for one page (or the whole result), in priority order."""
+    pages = [page for page in result.pages or [] if page_number is None or page.page_number == page_number]
+    page_spans = [span for page in pages for span in page.spans or []]
+    handwritten_spans = [span for style in result.styles or [] if style.is_handwritten
+                         for span in style.spans or []
+                         if page_number is None or _overlaps([span], page_spans)]
+    tables = [table for table in result.tables or [] if _on_page(table.bounding_regions, page_number)]
+    table_spans = [span for table in tables for cell in table.cells for span in cell.spans or []]
+    key_value_pairs = [pair for pair in getattr(result, "key_value_pairs", None) or []
+                       if pair.key is not None and _on_page(pair.key.bounding_regions, page_number)]
+    pair_spans = [span for pair in key_value_pairs for element in (pair.key, pair.value) if element is not None
+                  for span in element.spans or []]
+    lines = [line for page in pages for line in page.lines or []]
+
+    pair_blocks = [f"- {_normalize_line(pair.key.content)}: {_normalize_line(pair.value.content) if pair.value else ''}"
+                   for pair in key_value_pairs]
+
+    checkbox_blocks, label_lines = [], set()
+    for page in pages:
+        for mark in page.selection_marks or []:
+            label_index = _checkbox_label(mark, page.lines or [])
+            label = _normalize_line(page.lines[label_index].content) if label_index is not None else ""
+            if label_index is not None:
+                label_lines.add(id(page.lines[label_index]))
+            checked = "x" if mark.state == "selected" else " "
+            checkbox_blocks.append(f"- [{checked}] {label or '(unlabeled)'}")
+
+    table_blocks = [block for block in (_markdown_table(table, page_number) for table in tables) if block]
+
+    text_blocks, seen = [], set()
+    for line in lines:
+        text = _normalize_line(line.content)
+        key = text.lower()
+        if (not text or key in seen or key in skip_lines or _is_boilerplate(text) or id(line) in label_lines
+                or _overlaps(line.spans, table_spans) or _overlaps(line.spans, pair_spans)):
+            continue
+        seen.add(key)
+        text_blocks.append(f"{text} (handwritten)" if _overlaps(line.spans, handwritten_spans) else text)
+
+    return [("Key-value pairs", pair_blocks), ("Checkboxes", checkbox_blocks), ("Tables", table_blocks),
+            ("Text", text_blocks)]
+
+
+def serialize_layout(result, page_number=None, token_budget=LAYOUT_TOKEN_BUDGET, skip_lines=frozenset()):
+    """Render a Doc Intel AnalyzeResult (or one page of it) as compact markdown within token_budget.
+
+    skip_lines holds normalized, lower-cased lines to leave out, e.g. from repeated_lines().
+    A token_budget of None or 0 disables the budget.
+    """
+    sections = _page_sections(result, page_number, skip_lines)
+    used, omitted = 0, 0
+    kept = {title: [] for title, _ in sections}
+    for title, blocks in sections:
+        heading_cost = estimate_tokens(f"## {title}\n")
+        for block in blocks:
+            cost = estimate_tokens(block + "\n") + (0 if kept[title] else heading_cost)
+            if token_budget and used + cost > token_budget:
+                omitted += 1
+                continue
+            kept[title].append(block)
+            used += cost
+
+    parts = [f"## {title}\n" + "\n".join(blocks) for title, blocks in kept.items() if blocks]
+    if omitted:
+        parts.append(f"[{omitted} lower-priority items omitted to fit the token budget]")
+    return "\n\n".join(parts)
+
+
+def token_savings(verbose_text, compact_text):
+    """Compare prompt sizes of the verbose and compact renderings of the same layout."""
+    verbose_tokens, compact_tokens = estimate_tokens(verbose_text), estimate_tokens(compact_text)
+    return {"verbose_tokens": verbose_tokens, "compact_tokens": compact_tokens,
+            "saved_tokens": verbose_tokens - compact_tokens}
@@ -1,6 +1,5 @@
 import re
 from typing import List, Dict, Tuple
-import pandas as pd
 import numpy as np
 
 
@@ -16,33 +15,41 @@ class LogprobsHandler:
         match = re.search(r'([^"]+)"\s*:', key)
         return match.group(1) if match else None
 
+    # Token suffixes that likely end a key-value pair
+    PAIR_END_SUFFIXES = (',\n', ']\n', '"}', "'}", ',"', ",'")
+
+    def _pair_boundaries(self, tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # Per-token masks: part of a pair (non-blank, not a bare brace) and likely ends a pair
+        stripped = [token.strip() for token in tokens]
+        in_pair = np.fromiter((s != '' and s not in ('{', '}') for s in stripped), dtype=bool, count=len(tokens))
+        ends_pair = np.fromiter(
+            (token.endswith(self.PAIR_END_SUFFIXES) or s.endswith((',', '}')) for token, s in zip(tokens, stripped)),
+            dtype=bool, count=len(tokens))
+        return in_pair, ends_pair
+
     def calculate_words_probas(self, logprobs_formatted: List[Dict]) -> List[Tuple[str, float]]:
-        probas_df = pd.DataFrame({'token': [i['token'] for i in logprobs_formatted],
-                                  'logprob': [i['logprob'] for i in logprobs_formatted]})
+        tokens = [str(i['token']) for i in logprobs_formatted]
+        logprobs = np.fromiter((i['logprob'] for i in logprobs_formatted), dtype=float, count=len(tokens))
+        if not tokens:
+            return []
 
         # Combine tokens into key-value pairs
-        # Assuming tokens that form key-value pairs are sequential
-        key_value_pairs = []
-        current_pair = []
-        for idx, row in probas_df.iterrows():
-            token = str(row['token'])
-            if token.strip() != '' and not token.strip() in ['{', '}']:
-                current_pair.append(idx)
-            # Check if the token likely ends a key-value pair
-            if token.endswith(',\n') or token.endswith(']\n') or token.strip().endswith(',') or token.strip().endswith(
-                    '}') or token.endswith('"}') or token.endswith("'}") or token.endswith(',"') or token.endswith(
-                ",'"):
-                if len(current_pair) > 0:
-                    key_value_pairs.append(current_pair)
-                current_pair = []
-
-        # Calculate key-value pair probabilities
-        pair_probs = []
-        for pair in key_value_pairs:
-            pair_logprob = probas_df.loc[pair, 'logprob'].sum()
-            pair_prob = self.logprob_to_prob(pair_logprob)
-            pair_probs.append((''.join(probas_df.loc[pair, 'token']), pair_prob))
-        return pair_probs
+        # Assuming tokens that form key-value pairs are sequential: a pair is every in-pair token
+        # since the previous boundary, up to and including the boundary token itself
+        in_pair, ends_pair = self._pair_boundaries(tokens)
+        segment = np.cumsum(ends_pair) - ends_pair
+        # Tokens after the last boundary never close a pair and are dropped
+        kept = np.flatnonzero(in_pair & (segment < ends_pair.sum()))
+        if kept.size == 0:
+            return []
+        kept_segments = segment[kept]
+        starts = np.flatnonzero(np.r_[True, kept_segments[1:] != kept_segments[:-1]])
+
+        # Calculate key-value pair probabilities with one reduction over all pairs
+        pair_probs = self.logprob_to_prob(np.add.reduceat(logprobs[kept], starts))
+        bounds = np.r_[starts, kept.size]
+        return [(''.join(tokens[i] for i in kept[bounds[j]:bounds[j + 1]]), float(pair_probs[j]))
+                for j in range(len(starts))]
 
     def format_logprobs(self, logprobs) -> List[Dict]:
         logprobs_formatted = []
@@ -55,25 +62,29 @@ class LogprobsHandler:
 
     def process_logprobs(self, logprobs_formatted: List[Dict], nested_keys_dct: Dict[str, List[str]] = None):
         pair_probs = self.calculate_words_probas(logprobs_formatted)
-        pair_df = pd.DataFrame(pair_probs, columns=['key_value_pair', 'agg_tokens_proba'])
-        pair_df['field_name'] = pair_df['key_value_pair'].apply(self.extract_key_name)
-        pair_df = pair_df[pair_df['field_name'].notna()]
+        field_names = []
+        key_value_pairs = []
+        agg_tokens_probas = []
+        for key_value_pair, proba in pair_probs:
+            field_name = self.extract_key_name(key_value_pair)
+            if field_name is not None:
+                field_names.append(field_name)
+                key_value_pairs.append(key_value_pair)
+                agg_tokens_probas.append(proba)
 
         if nested_keys_dct is not None:
             for nested_key_name, nested_key_values in nested_keys_dct.items():
-                nested_key_str = '|'.join(nested_key_values)
+                nested_key_pattern = re.compile('|'.join(nested_key_values), re.IGNORECASE)
                 # calculate the aggregated nested keys confidence from all the related sub-keys
-                nested_rows = pair_df[pair_df['field_name'].str.contains(nested_key_str, case=False)]
+                nested_rows = [i for i, field_name in enumerate(field_names) if nested_key_pattern.search(field_name)]
                 if len(nested_rows) > 0:
-                    new_row = pd.DataFrame({
-                        'key_value_pair': [' '.join(nested_rows['key_value_pair'])],
-                        'agg_tokens_proba': [nested_rows['agg_tokens_proba'].prod()],
-                        'field_name': [nested_key_name]
-                    })
-                    pair_df = pd.concat([pair_df, new_row], axis=0, ignore_index=True)
-        pair_df['agg_tokens_proba'] = pair_df['agg_tokens_proba'].round(4)
-
-        fields_llm_confidences = dict(pair_df.set_index('field_name')['agg_tokens_proba'].to_dict())
+                    field_names.append(nested_key_name)
+                    key_value_pairs.append(' '.join(key_value_pairs[i] for i in nested_rows))
+                    agg_tokens_probas.append(float(np.prod([agg_tokens_probas[i] for i in nested_rows])))
+
+        # Later duplicates win, as with a dict built from the rows in order
+        rounded = np.round(np.asarray(agg_tokens_probas, dtype=float), 4)
+        fields_llm_confidences = {field_name: float(proba) for field_name, proba in zip(field_names, rounded)}
         return fields_llm_confidences
 
     def calculate_confidence_scores(self, input_data_list):
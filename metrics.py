@@ -0,0 +1,199 @@
+"""Per-stage latency, token, payload and retry instrumentation.
+
+A RunMetrics collector is made active for a run with use_metrics(). Code anywhere in the
+pipeline then records into it through the module-level span() and add() helpers, which are
+no-ops when no collector is active. Document/page labels come from labels() blocks (or
+explicit keyword arguments), so deep helpers such as the Doc Intel poller don't need to
+know which page they are working on. Collectors and labels live in context variables;
+PagePipeline copies the context into its worker threads.
+"""
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Rough list prices used for the estimated run cost; adjust to your deployment's pricing
+PROMPT_COST_PER_1K_TOKENS = 0.0025
+COMPLETION_COST_PER_1K_TOKENS = 0.01
+DOC_INTEL_COST_PER_PAGE = 0.01
+
+_current_metrics = contextvars.ContextVar("current_metrics", default=None)
+_current_labels = contextvars.ContextVar("current_labels", default={})
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _stage_stats(durations):
+    durations = sorted(durations)
+    return {
+        "count": len(durations),
+        "total_seconds": round(sum(durations), 4),
+        "p50_seconds": round(_percentile(durations, 0.5), 4),
+        "p95_seconds": round(_percentile(durations, 0.95), 4),
+        "max_seconds": round(durations[-1], 4) if durations else 0.0,
+    }
+
+
+class RunMetrics:
+    """Thread-safe collector of timing spans and counters for one run."""
+
+    def __init__(self):
+        self.events = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, value, labels):
+        event = {"kind": kind, "name": name, "value": value, "time": time.time()}
+        event.update({key: value for key, value in labels.items() if value is not None})
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        """Aggregate spans and counters for the whole run, per document and per page."""
+        with self._lock:
+            events = list(self.events)
+
+        def aggregate(selected):
+            durations, counters, errors = defaultdict(list), defaultdict(int), defaultdict(int)
+            for event in selected:
+                if event["kind"] == "span":
+                    durations[event["name"]].append(event["value"])
+                    if event.get("error"):
+                        errors[event["name"]] += 1
+                else:
+                    counters[event["name"]] += event["value"]
+            stages = {stage: _stage_stats(values) for stage, values in durations.items()}
+            for stage, count in errors.items():
+                stages[stage]["errors"] = count
+            return {"stages": stages, "counters": {name: round(value, 4) for name, value in counters.items()},
+                    "estimated_cost_usd": estimated_cost(counters)}
+
+        by_document, by_page = defaultdict(list), defaultdict(list)
+        for event in events:
+            if "document" in event:
+                by_document[event["document"]].append(event)
+                if "page" in event:
+                    by_page[f"{event['document']}#{event['page']}"].append(event)
+
+        run = aggregate(events)
+        run["wall_seconds"] = round(time.time() - self.started_at, 4)
+        run["documents"] = {document: aggregate(selected) for document, selected in by_document.items()}
+        run["pages"] = {page: aggregate(selected) for page, selected in by_page.items()}
+        return run
+
+    def to_prometheus(self, prefix="idp"):
+        """Render run-level aggregates in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds_total counter",
+            *[f'{prefix}_stage_seconds_total{{stage="{stage}"}} {stats["total_seconds"]}'
+              for stage, stats in summary["stages"].items()],
+            f"# TYPE {prefix}_stage_calls_total counter",
+            *[f'{prefix}_stage_calls_total{{stage="{stage}"}} {stats["count"]}'
+              for stage, stats in summary["stages"].items()],
+            f"# TYPE {prefix}_stage_errors_total counter",
+            *[f'{prefix}_stage_errors_total{{stage="{stage}"}} {stats.get("errors", 0)}'
+              for stage, stats in summary["stages"].items()],
+            f"# TYPE {prefix}_stage_latency_seconds gauge",
+        ]
+        for stage, stats in summary["stages"].items():
+            lines.append(f'{prefix}_stage_latency_seconds{{stage="{stage}",quantile="0.5"}} {stats["p50_seconds"]}')
+            lines.append(f'{prefix}_stage_latency_seconds{{stage="{stage}",quantile="0.95"}} {stats["p95_seconds"]}')
+        lines.append(f"# TYPE {prefix}_counter_total counter")
+        lines.extend(f'{prefix}_counter_total{{name="{name}"}} {value}' for name, value in summary["counters"].items())
+        lines.append(f"# TYPE {prefix}_estimated_cost_usd gauge")
+        lines.append(f"{prefix}_estimated_cost_usd {summary['estimated_cost_usd']}")
+        lines.append(f"# TYPE {prefix}_run_wall_seconds gauge")
+        lines.append(f"{prefix}_run_wall_seconds {summary['wall_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self):
+        """Render every recorded span and counter as one JSON object per line."""
+        with self._lock:
+            return "".join(json.dumps(event) + "\n" for event in self.events)
+
+    def write_prometheus(self, path):
+        with open(path, "w") as metrics_file:
+            metrics_file.write(self.to_prometheus())
+
+    def write_jsonl(self, path):
+        with open(path, "a") as metrics_file:
+            metrics_file.write(self.to_jsonl())
+
+
+def merged(collectors):
+    """Combine several collectors (e.g. one per background job) into a new one for a run-level summary."""
+    combined = RunMetrics()
+    for run_metrics in collectors:
+        with run_metrics._lock:
+            combined.events.extend(run_metrics.events)
+        combined.started_at = min(combined.started_at, run_metrics.started_at)
+    return combined
+
+
+def estimated_cost(counters):
+    """Estimate the spend implied by token and Doc Intel page counters, in USD."""
+    return round(counters.get("prompt_tokens", 0) / 1000 * PROMPT_COST_PER_1K_TOKENS
+                 + counters.get("completion_tokens", 0) / 1000 * COMPLETION_COST_PER_1K_TOKENS
+                 + counters.get("doc_intel_pages", 0) * DOC_INTEL_COST_PER_PAGE, 6)
+
+
+@contextmanager
+def use_metrics(run_metrics):
+    """Make run_metrics the active collector for the enclosed block (and threads started from it via PagePipeline)."""
+    token = _current_metrics.set(run_metrics)
+    try:
+        yield run_metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def labels(**new_labels):
+    """Attach labels such as document= and page= to everything recorded in the enclosed block."""
+    token = _current_labels.set({**_current_labels.get(), **new_labels})
+    try:
+        yield
+    finally:
+        _current_labels.reset(token)
+
+
+@contextmanager
+def span(stage, **extra_labels):
+    """Time the enclosed block as one call of stage; exceptions are counted as errors and re-raised."""
+    run_metrics = _current_metrics.get()
+    if run_metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        span_labels = {**_current_labels.get(), **extra_labels, "error": error or None}
+        run_metrics.record("span", stage, time.perf_counter() - start, span_labels)
+
+
+def add(name, value=1, **extra_labels):
+    """Add value to counter name (e.g. prompt_tokens, image_bytes, retries) in the active collector."""
+    run_metrics = _current_metrics.get()
+    if run_metrics is not None:
+        run_metrics.record("counter", name, value, {**_current_labels.get(), **extra_labels})
+
+
+def record_usage(usage, **extra_labels):
+    """Record prompt/completion tokens from an OpenAI response.usage object."""
+    if usage is None:
+        return
+    add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0, **extra_labels)
+    add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0, **extra_labels)
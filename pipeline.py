@@ -0,0 +1,222 @@
+import contextvars
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Default concurrency limits per remote service
+DOC_INTEL_CONCURRENCY = 4
+GPT_CONCURRENCY = 4
+
+# Retry settings for throttled (HTTP 429) and transient (5xx) failures
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Events yielded by PagePipeline.run
+PageResult = namedtuple("PageResult", ["index", "page", "layout", "result", "error"])
+PageUpdate = namedtuple("PageUpdate", ["page", "update"])
+
+
+def _status_code(exc):
+    """Return the HTTP status code carried by an OpenAI or Azure SDK exception, if any."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(exc):
+    """Whether exc is a throttled (429) or transient (5xx) service failure worth retrying."""
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def _retry_after_seconds(exc):
+    """Return the server-requested delay from a Retry-After style header, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for header in ("retry-after-ms", "Retry-After", "retry-after"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            continue
+        return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+
+def call_with_retries(fn, *args, max_retries=MAX_RETRIES, base_delay=BACKOFF_BASE_SECONDS,
+                      max_delay=BACKOFF_MAX_SECONDS, sleep=time.sleep, **kwargs):
+    """Call fn, retrying throttled/transient failures with Retry-After aware jittered backoff."""
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                # Full jitter: spread retries out so parallel workers don't hammer the service in lockstep
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            attempt += 1
+            metrics.add("retries")
+            print(f"Retrying {getattr(fn, '__name__', fn)} in {delay:.2f}s (attempt {attempt}/{max_retries}): {e}")
+            sleep(min(delay, max_delay))
+
+
+class PagePipeline:
+    """Runs the Doc Intel and GPT stages for many pages concurrently.
+
+    Each page goes through analyze_fn(page) and then extract_fn(page, layout). Calls to each
+    service are bounded by their own semaphore, so Doc Intel polling for one page overlaps
+    with GPT extraction for another.
+
+    With limit_analyze=False analyze_fn runs without taking a Doc Intel slot; it is then
+    responsible for acquiring doc_intel_slots around the actual remote call (e.g. when one
+    whole-document analysis is shared by many pages).
+
+    doc_intel_slots and gpt_slots optionally pass in shared semaphores, so several pipelines
+    (e.g. one per background job) stay within one process-wide limit per service; the
+    concurrency arguments then only size the worker pool.
+
+    page_labels(page) optionally returns metrics labels (e.g. document and page) that are
+    attached to everything recorded while that page is processed. Worker threads run in a
+    copy of the caller's context, so an active metrics collector is picked up.
+    """
+
+    def __init__(self, analyze_fn, extract_fn, doc_intel_concurrency=DOC_INTEL_CONCURRENCY,
+                 gpt_concurrency=GPT_CONCURRENCY, max_retries=MAX_RETRIES, limit_analyze=True,
+                 page_labels=None, doc_intel_slots=None, gpt_slots=None):
+        self.analyze_fn = analyze_fn
+        self.extract_fn = extract_fn
+        self.max_retries = max_retries
+        self.limit_analyze = limit_analyze
+        self.page_labels = page_labels
+        self.max_workers = doc_intel_concurrency + gpt_concurrency
+        self.doc_intel_slots = doc_intel_slots or threading.Semaphore(doc_intel_concurrency)
+        self._gpt_slots = gpt_slots or threading.Semaphore(gpt_concurrency)
+        self._events = None
+
+    def report(self, page, update):
+        """Send an intermediate update for a page (e.g. a streamed field) from a worker thread.
+
+        Updates are yielded by run() as PageUpdate events on the caller's thread.
+        """
+        if self._events is not None:
+            self._events.put(PageUpdate(page, update))
+
+    def _process(self, page):
+        with metrics.labels(**(self.page_labels(page) if self.page_labels else {})):
+            return self._process_stages(page)
+
+    def _process_stages(self, page):
+        if self.limit_analyze:
+            with self.doc_intel_slots:
+                layout = call_with_retries(self.analyze_fn, page, max_retries=self.max_retries)
+        else:
+            layout = call_with_retries(self.analyze_fn, page, max_retries=self.max_retries)
+        with self._gpt_slots:
+            result = call_with_retries(self.extract_fn, page, layout, max_retries=self.max_retries)
+        return layout, result
+
+    def run(self, pages, max_in_flight=None):
+        """Process pages and yield a PageResult(index, page, layout, result, error) as each one completes.
+
+        Results are yielded in completion order; index is the page's position in the input so
+        callers can restore the original order. Consuming the generator from the caller's
+        thread keeps UI updates (e.g. Streamlit) off the worker threads.
+
+        pages may be a lazy iterable (e.g. a rasterizing generator). It is consumed on a
+        feeder thread, and at most max_in_flight pages (default twice the worker count) are
+        held between being produced and being yielded back, which bounds memory use.
+
+        Updates sent through report() while a page is in flight are yielded as PageUpdate
+        events in between.
+        """
+        events = self._events = queue.Queue()
+        in_flight = threading.Semaphore(max_in_flight or self.max_workers * 2)
+        stopped = threading.Event()
+        feed_done = object()
+
+        def worker(index, page):
+            try:
+                layout, result = self._process(page)
+                events.put(PageResult(index, page, layout, result, None))
+            except Exception as e:
+                events.put(PageResult(index, page, None, None, e))
+
+        def feed(executor):
+            count = 0
+            try:
+                for index, page in enumerate(pages):
+                    in_flight.acquire()
+                    if stopped.is_set():
+                        break
+                    executor.submit(contextvars.copy_context().run, worker, index, page)
+                    count += 1
+            except Exception as e:
+                events.put((feed_done, count, e))
+            else:
+                events.put((feed_done, count, None))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            feeder = threading.Thread(target=contextvars.copy_context().run, args=(feed, executor), daemon=True)
+            feeder.start()
+            expected, received, feed_error = None, 0, None
+            try:
+                while expected is None or received < expected:
+                    event = events.get()
+                    if event[0] is feed_done:
+                        _, expected, feed_error = event
+                        continue
+                    if isinstance(event, PageUpdate):
+                        yield event
+                        continue
+                    received += 1
+                    yield event
+                    in_flight.release()
+            finally:
+                # Unblock the feeder if the caller stopped consuming early
+                stopped.set()
+                in_flight.release()
+        if feed_error is not None:
+            raise feed_error
+
+if __name__ == "__main__":
+    # Compare serial vs. pipelined throughput against stub services that only sleep
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure pipeline throughput with stub Doc Intel/GPT clients.")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--doc-intel-latency", type=float, default=0.5)
+    parser.add_argument("--gpt-latency", type=float, default=1.0)
+    parser.add_argument("--doc-intel-concurrency", type=int, default=DOC_INTEL_CONCURRENCY)
+    parser.add_argument("--gpt-concurrency", type=int, default=GPT_CONCURRENCY)
+    args = parser.parse_args()
+
+    def stub_analyze(page):
+        time.sleep(args.doc_intel_latency)
+        return f"layout for page {page}"
+
+    def stub_extract(page, layout):
+        time.sleep(args.gpt_latency)
+        return f'{{"page": {page}}}'
+
+    start = time.perf_counter()
+    for page in range(args.pages):
+        stub_extract(page, stub_analyze(page))
+    elapsed = time.perf_counter() - start
+    print(f"serial: {args.pages} pages in {elapsed:.2f}s ({args.pages / elapsed:.2f} pages/sec)")
+
+    pipeline = PagePipeline(stub_analyze, stub_extract, args.doc_intel_concurrency, args.gpt_concurrency)
+    start = time.perf_counter()
+    results = list(pipeline.run(range(args.pages)))
+    elapsed = time.perf_counter() - start
+    print(f"pipelined: {len(results)} pages in {elapsed:.2f}s ({len(results) / elapsed:.2f} pages/sec)")
@@ -0,0 +1,227 @@
+import json
+import math
+
+# Keys that identify a {"field_name": ..., "field_value": ...} style pair object
+FIELD_NAME_KEYS = ("field_name", "key", "label")
+FIELD_VALUE_KEYS = ("field_value", "value")
+
+_WHITESPACE = " \t\r\n"
+
+
+class StreamingFieldParser:
+    """Incrementally parses a JSON completion and emits fields with confidences as they close.
+
+    Tokens are fed one at a time with their log-probability, either directly via feed() or
+    from chat-completion stream chunks via feed_chunk(). A small state machine tracks JSON
+    structure (objects, arrays, keys, strings, literals and nesting), so values containing
+    colons, commas or braces are handled correctly.
+
+    Every scalar value produces a field as soon as it closes:
+    - inside a pair object ({"field_name": "Payee", "field_value": "ACME"}, also "key"/"label"
+      and "value"), one field is emitted once both the name and the value are known, with the
+      lower of the two confidences;
+    - anywhere else the field name is the key path (e.g. "Applicant.Address[0]") and the
+      confidence covers the tokens of both the key and the value.
+
+    Fields are dicts with field_name, field_value and field_confidence, matching
+    LogprobsHandler.calculate_confidence_scores. Confidence is the joint probability of the
+    tokens that produced the text, or None when no logprobs were supplied.
+    """
+
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.fields = []
+        self.text = ""
+        self._logprobs = []
+        self._stack = []
+        self._state = "value"
+        self._buffer = ""
+        self._buffer_tokens = set()
+        self._buffer_is_key = False
+        self._escape = False
+
+    def feed_chunk(self, chunk):
+        """Consume one chat-completion stream chunk; returns the fields it completed."""
+        if not chunk.choices:
+            return []
+        choice = chunk.choices[0]
+        token_logprobs = choice.logprobs.content if getattr(choice, "logprobs", None) else None
+        if token_logprobs:
+            emitted = []
+            for token_logprob in token_logprobs:
+                emitted.extend(self.feed(token_logprob.token, token_logprob.logprob))
+            return emitted
+        return self.feed(choice.delta.content or "", None)
+
+    def feed(self, token, logprob=None):
+        """Consume one token of completion text; returns the fields it completed."""
+        token_index = len(self._logprobs)
+        self._logprobs.append(logprob)
+        self.text += token
+        emitted_before = len(self.fields)
+        for char in token:
+            self._feed_char(char, token_index)
+        return self.fields[emitted_before:]
+
+    def document(self):
+        """Return the completion parsed as JSON (only valid once the stream has finished)."""
+        return json.loads(self.text)
+
+    def file_fields(self):
+        """Return {"file_name", "fields"} as produced by LogprobsHandler.calculate_confidence_scores.
+
+        Raises ValueError when the completion is not a JSON object.
+        """
+        document = self.document()
+        if not isinstance(document, dict):
+            raise ValueError(f"expected a JSON object, got {type(document).__name__}")
+        return {
+            "file_name": document.get("file_name", ""),
+            "fields": [field for field in self.fields if field["field_name"] != "file_name"],
+        }
+
+    def _confidence(self, token_indices):
+        logprobs = [self._logprobs[i] for i in token_indices]
+        if not logprobs or any(logprob is None for logprob in logprobs):
+            return None
+        return round(math.exp(sum(logprobs)), 4)
+
+    def _feed_char(self, char, token_index):
+        state = self._state
+        if state == "string":
+            self._buffer_tokens.add(token_index)
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                raw = self._buffer
+                self._close_scalar(json.loads(f'"{raw}"'))
+                return
+            self._buffer += char
+            return
+
+        if state == "literal":
+            if char not in _WHITESPACE and char not in ",}]":
+                self._buffer_tokens.add(token_index)
+                self._buffer += char
+                return
+            # The delimiter belongs to the enclosing structure, not the literal
+            try:
+                value = json.loads(self._buffer)
+            except ValueError:
+                value = self._buffer
+            self._close_scalar(value)
+            self._feed_char(char, token_index)
+            return
+
+        if char in _WHITESPACE:
+            return
+
+        if state == "done":
+            return
+
+        if state == "colon":
+            if char == ":":
+                self._state = "value"
+            return
+
+        if state == "key_or_end":
+            if char == '"':
+                self._start_scalar(token_index, is_key=True, is_string=True)
+            elif char == "}":
+                self._pop()
+            return
+
+        if state == "comma_or_end":
+            if char == ",":
+                self._state = "key_or_end" if self._stack[-1]["type"] == "object" else "value"
+            elif char in "}]":
+                self._pop()
+            return
+
+        # state == "value"
+        if char == "{":
+            self._push("object")
+            self._state = "key_or_end"
+        elif char == "[":
+            self._push("array")
+            self._state = "value"
+        elif char == "]" and self._stack and self._stack[-1]["type"] == "array":
+            # Empty array
+            self._pop()
+        elif char == '"':
+            self._start_scalar(token_index, is_key=False, is_string=True)
+        else:
+            self._start_scalar(token_index, is_key=False, is_string=False)
+            self._buffer = char
+
+    def _start_scalar(self, token_index, is_key, is_string):
+        self._state = "string" if is_string else "literal"
+        self._buffer = ""
+        self._buffer_tokens = {token_index}
+        self._buffer_is_key = is_key
+        self._escape = False
+
+    def _push(self, container_type):
+        self._stack.append({"type": container_type, "key": None, "key_tokens": set(), "index": 0,
+                            "name": None, "value": None, "emitted": False})
+
+    def _pop(self):
+        self._stack.pop()
+        if self._stack:
+            self._advance_container()
+        self._state = "comma_or_end" if self._stack else "done"
+
+    def _advance_container(self):
+        frame = self._stack[-1]
+        if frame["type"] == "array":
+            frame["index"] += 1
+        else:
+            frame["key"] = None
+            frame["key_tokens"] = set()
+
+    def _path(self):
+        parts = []
+        for frame in self._stack:
+            if frame["type"] == "object" and frame["key"] is not None:
+                parts.append(("." if parts else "") + frame["key"])
+            elif frame["type"] == "array":
+                parts.append(f"[{frame['index']}]")
+        return "".join(parts)
+
+    def _close_scalar(self, value):
+        tokens = self._buffer_tokens
+        if self._buffer_is_key:
+            frame = self._stack[-1]
+            frame["key"] = value
+            frame["key_tokens"] = tokens
+            self._state = "colon"
+            return
+
+        self._state = "comma_or_end" if self._stack else "done"
+        if not self._stack:
+            return
+        frame = self._stack[-1]
+        key = frame["key"] if frame["type"] == "object" else None
+        if key in FIELD_NAME_KEYS:
+            frame["name"] = (value, self._confidence(tokens))
+        elif key in FIELD_VALUE_KEYS:
+            frame["value"] = (value, self._confidence(tokens))
+        else:
+            self._emit(self._path(), value, self._confidence(tokens | frame["key_tokens"]))
+            self._advance_container()
+            return
+
+        if frame["name"] is not None and frame["value"] is not None and not frame["emitted"]:
+            frame["emitted"] = True
+            (name, name_confidence), (field_value, value_confidence) = frame["name"], frame["value"]
+            confidences = [c for c in (name_confidence, value_confidence) if c is not None]
+            self._emit(name, field_value, min(confidences) if confidences else None)
+        self._advance_container()
+
+    def _emit(self, field_name, field_value, confidence):
+        field = {"field_name": field_name, "field_value": field_value, "field_confidence": confidence}
+        self.fields.append(field)
+        if self.on_field is not None:
+            self.on_field(field)
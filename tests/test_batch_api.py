@@ -0,0 +1,102 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+
+import pytest
+from openai import AzureOpenAI
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+import fake_services  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = fake_services.start_fake_services(fake_services.FakeServiceConfig(
+        doc_intel_latency=0.05, doc_intel_page_latency=0.0, gpt_latency=0.0, token_latency=0.0, batch_latency=0.2))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope="module")
+def batch_runner(server, tmp_path_factory):
+    # idp_agent reads config.py and creates its results/ cache in the working directory at import
+    work_dir = tmp_path_factory.mktemp("work")
+    (work_dir / "config.py").write_text(
+        f'AZURE_OPENAI_KEY = "fake-key"\n'
+        f'AZURE_OPENAI_ENDPOINT = "{server.base_url}"\n'
+        f'AZURE_OPENAI_DEPLOYMENT = "fake-deployment"\n'
+        f'AZURE_DOC_INTEL_ENDPOINT = "{server.base_url}"\n'
+        f'AZURE_DOC_INTEL_KEY = "fake-key"\n'
+        f'AZURE_STORAGE_CONNECTION_STRING = "UseDevelopmentStorage=true"\n'
+    )
+    cwd = os.getcwd()
+    sys.path[:0] = [str(work_dir), REPO_DIR]
+    os.chdir(work_dir)
+    try:
+        yield importlib.import_module("batch_runner")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def batch_client(server):
+    return AzureOpenAI(azure_endpoint=server.base_url, api_key="fake-key", api_version="2024-10-21")
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for index in range(6):
+        Image.new("RGB", (200, 100), (255, 255 - index, 255)).save(input_dir / f"check_{index}.png")
+    return input_dir
+
+
+def run_args(input_dir, output):
+    return argparse.Namespace(input_dir=str(input_dir), output=str(output), task="check", doc_intel_concurrency=2,
+                              gpt_concurrency=2, batch_api=True, batch_deployment="fake-deployment",
+                              no_wait=False, batch_poll_seconds=0.05)
+
+
+def read_jsonl(path):
+    with open(path) as jsonl_file:
+        return [json.loads(line) for line in jsonl_file if line.strip()]
+
+
+def test_submit_and_collect_with_error_lines(server, batch_runner, batch_client, input_dir, tmp_path):
+    server.config.batch_error_rate = 0.5
+    output = str(tmp_path / "results.jsonl")
+    try:
+        state, failures = batch_runner.submit_batch_jobs(str(input_dir), output, batch_client=batch_client)
+        summary = batch_runner.collect_batch_jobs(output, batch_client, poll_seconds=0.05)
+    finally:
+        server.config.batch_error_rate = 0.0
+
+    assert not failures and len(state["items"]) == 6
+    records = read_jsonl(output)
+    failed = summary["failures"].get("batch", 0)
+    assert 0 < failed < 6
+    assert summary["pages_processed"] == len(records) == 6 - failed
+    for record in records:
+        assert {field["field_name"] for field in record["result"]["fields"]} >= {"Payee", "Amount"}
+    # Only the answered pages are marked complete, so the failed ones are submitted again
+    assert len(read_jsonl(output + ".manifest.jsonl")) == len(records)
+    assert os.path.exists(os.path.join(output + ".batch", "state.json.collected"))
+
+
+def test_expired_batch_is_resubmitted_by_the_next_run(server, batch_runner, batch_client, input_dir, tmp_path):
+    output = tmp_path / "results.jsonl"
+    server.config.batch_expire_rate = 1.0
+    try:
+        summary = batch_runner.run_mode(run_args(input_dir, output), batch_client)
+    finally:
+        server.config.batch_expire_rate = 0.0
+    assert summary["pages_processed"] == 0 and summary["failures"] == {"batch": 6}
+
+    summary = batch_runner.run_mode(run_args(input_dir, output), batch_client)
+    assert summary["pages_processed"] == 6 and not summary["failures"]
+    assert sorted(record["item_id"] for record in read_jsonl(output)) == [f"check_{index}.png#1" for index in range(6)]
@@ -0,0 +1,85 @@
+import json
+from decimal import Decimal
+
+from field_matching import align_fields, compare_groups, normalize_value
+
+
+def compare(results_dict):
+    return compare_groups(*align_fields({doc_name: [json.dumps(fields)] for doc_name, fields in results_dict.items()}))
+
+
+def test_amounts_need_money_formatting_or_an_amount_key():
+    assert normalize_value("$1,200.00", "amount") == ("amount", Decimal("1200.00"))
+    assert normalize_value("1200", "amount") == ("amount", Decimal("1200.00"))
+    assert normalize_value("12.50") == ("amount", Decimal("12.50"))
+    assert normalize_value("1200", "check number") == ("identifier", "1200")
+
+
+def test_identifiers_keep_leading_zeros_and_digit_order():
+    assert normalize_value("02139", "zip code") != normalize_value("2139", "zip code")
+    assert normalize_value("555-1234", "phone number") == normalize_value("5551234", "phone number")
+    assert normalize_value("555-1234", "phone number") != normalize_value("1234-555", "phone number")
+
+
+def test_word_order_is_ignored_for_names_only():
+    assert normalize_value("Doe, John", "name") == normalize_value("John Doe", "name")
+    assert normalize_value("pay now", "note") != normalize_value("now pay", "note")
+
+
+def test_dates_and_checkboxes_normalize():
+    assert normalize_value("01/02/2020") == normalize_value("2020-01-02") == ("date", "2020-01-02")
+    assert normalize_value("Yes") == normalize_value(True) == ("checkbox", "checked")
+
+
+def test_numbered_keys_are_not_merged():
+    _, groups = align_fields({"a": [json.dumps({"Dependent 1 Name": "Bob Doe", "Dependent 2 Name": "Carol Doe",
+                                                "Address Line 1": "1 Main St", "Address Line 2": "Apt 5"})]})
+    assert sorted(groups) == ["address line 1", "address line 2", "dependent 1 name", "dependent 2 name"]
+
+
+def test_fuzzy_matching_only_pairs_keys_across_documents():
+    _, groups = align_fields({"a": [json.dumps({"Employer Phone": "555-1234", "Employer Phones": "555-9999"})],
+                              "b": [json.dumps({"Employer Phon": "555-1234"})]})
+    assert sorted(groups) == ["employer phone", "employer phones"]
+    assert groups["employer phone"]["values"] == {"a": ["555-1234"], "b": ["555-1234"]}
+    assert groups["employer phone"]["fuzzy"]
+
+
+def test_repeated_field_names_in_one_document_are_compared_by_occurrence():
+    resolved, unresolved = compare({"a": {"dependents": [{"name": "Bob Doe"}, {"name": "Carol Doe"}]},
+                                    "b": {"dependents": [{"name": "Bob Doe"}, {"name": "Dave Doe"}]}})
+    assert resolved["dependents[0].name"]["type"] == "consistent"
+    assert unresolved == {"dependents[1].name": {"a": "Carol Doe", "b": "Dave Doe"}}
+
+
+def test_second_numbered_field_difference_is_not_hidden():
+    resolved, unresolved = compare({
+        "a": {"Dependent 1 Name": "Bob Doe", "Dependent 2 Name": "Carol Doe", "Address Line 2": "Apt 5"},
+        "b": {"Dependent 1 Name": "Bob Doe", "Dependent 2 Name": "Dave Doe", "Address Line 2": "Apt 9"},
+    })
+    assert resolved["Dependent 1 Name"]["type"] == "consistent"
+    for label in ("Dependent 2 Name", "Address Line 2"):
+        assert resolved.get(label, {}).get("type") != "consistent"
+        assert label in resolved or label in unresolved
+
+
+def test_zip_and_account_numbers_with_dropped_leading_zeros_are_not_consistent():
+    resolved, unresolved = compare({"a": {"zip": "02139", "account number": "00123"},
+                                    "b": {"zip": "2139", "account number": "123"}})
+    assert "zip" not in resolved and "account number" not in resolved
+    assert set(unresolved) == {"zip", "account number"}
+
+
+def test_clear_mismatches_and_matches_are_resolved_locally():
+    resolved, unresolved = compare({"a": {"amount": "$1,200.00", "date": "01/02/2020", "phone": "555-1234"},
+                                    "b": {"amount": "1200", "date": "2020-01-03", "phone": "(555) 1234"}})
+    assert resolved["amount"]["type"] == "consistent"
+    assert resolved["date"]["type"] == "discrepancy"
+    assert resolved["phone"]["type"] == "consistent"
+    assert not unresolved
+
+
+def test_field_missing_from_a_document_is_a_discrepancy():
+    resolved, _ = compare({"a": {"payee": "ACME", "amount": "$5.00"}, "b": {"amount": "$5.00"},
+                           "c": {"payee": "ACME", "amount": "$5.00"}})
+    assert resolved["payee"] == {"values": ["ACME", None, "ACME"], "type": "discrepancy"}
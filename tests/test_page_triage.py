@@ -0,0 +1,31 @@
+from collections import namedtuple
+
+from page_triage import PageTriage
+
+PAGE = namedtuple("PageImage", ["page_number", "data", "mime_type"])(1, b"", "image/jpeg")
+TEXT = "## Text\n" + "\n".join(f"Clause {index}: the applicant agrees to the terms." for index in range(100))
+
+
+def route(layout_text):
+    return PageTriage(text_only_min_lines=80).route(PAGE, layout_text).action
+
+
+def test_plain_text_pages_go_text_only():
+    assert route(TEXT) == "text_only"
+    assert route("\n".join(f"...Line # {index} has text content 'Clause {index}'" for index in range(100))) == "text_only"
+
+
+def test_checkboxes_and_tables_do_not_count_as_text_and_keep_the_image():
+    rows = "\n".join(f"| Item {index} | 1 | 10.00 |" for index in range(100))
+    assert route(f"## Tables\n| Item | Qty | Price |\n|---|---|---|\n{rows}") == "full"
+    assert route("## Checkboxes\n- [x] Married\n\n" + TEXT) == "full"
+    assert route("## Tables\n| Item | Qty |\n|---|---|\n| Widget | 2 |\n\n" + TEXT) == "full"
+
+
+def test_truncated_layout_keeps_the_image():
+    assert route(TEXT + "\n\n[12 lower-priority items omitted to fit the token budget]") == "full"
+
+
+def test_empty_layout_is_skipped():
+    assert route("") == "skip"
+    assert route("Document contains no handwritten content\n----------------------------------------") == "skip"